@@ -0,0 +1,131 @@
+"""
+Batched augmentation of VoxelGridLoader batches: rotations by multiples of 90
+degrees about the vertical axis, x/y flips and small integer x/y translations
+
+    augment = TSDFAugmentation(max_shift=4)
+    for batch in DataLoader(loader, batch_size=8):
+        batch = augment(batch)
+
+Every sample draws one transform, applied identically to its scene grid, its
+object grids and their occupancy, for the whole batch with one index_select
+of z columns per key (on the device of the batch). The vertical axis (the last one, moved by
+TSDFScene.move_by_fixed_amount) is left alone, so the floor stays in its fixed
+row. Translations are limited so that the inside of the scene stays in the
+grid; the voxels moved in get the largest value of their grid (like the rows
+moved in by move_by_fixed_amount), zero for occupancy.
+
+Packed batches (batching.collate_packed) are handled too, every object with
+the transform of its scene.
+"""
+import torch
+
+# grids of a batch, (batch, channels, x, y, z), and of a packed batch, (objects, x, y, z)
+GRID_KEYS = ("scene", "scene_occ", "concatenated_objects", "concatenated_objects_occ")
+PACKED_KEYS = ("packed_objects", "packed_objects_occ")
+
+
+class TSDFAugmentation:
+
+    def __init__(self, rotate=True, flip=True, max_shift=4, generator=None):
+        """`generator` is an optional torch.Generator of the random transforms"""
+        self.rotate = rotate
+        self.flip = flip
+        self.max_shift = max_shift
+        self.generator = generator
+        self._tables = {}
+
+    @classmethod
+    def transform_table(cls, size, device=None):
+        """
+        (8, size, size) flat source index of every x/y output voxel of the 8
+        rotations (k * 90 degrees, transform % 4 = k) and flips (transform >= 4)
+        """
+        index = torch.arange(size * size, device=device).reshape(size, size)
+        return torch.stack([torch.rot90(torch.flip(index, dims=(0,)) if flip else index, k, dims=(0, 1))
+                            for flip in (False, True) for k in range(4)])
+
+    def sample(self, scene):
+        """
+        Random transforms of a batch of (batch, channels, x, y, z) scene grids:
+        transform index and x/y shift of every sample
+        """
+        n, device = len(scene), scene.device
+        transforms = torch.zeros(n, dtype=torch.long)
+        if self.rotate:
+            transforms += torch.randint(4, (n,), generator=self.generator)
+        if self.flip:
+            transforms += 4 * torch.randint(2, (n,), generator=self.generator)
+
+        shifts = torch.zeros((n, 2), dtype=torch.long)
+        if self.max_shift > 0:
+            # inside voxels of every sample along x and y, after the rotation and flip
+            inside = (scene < 0).any(dim=1).any(dim=-1).cpu()
+            size = inside.shape[-1]
+            table = self.transform_table(size)
+            inside = inside.reshape(n, -1).gather(1, table[transforms].reshape(n, -1)).reshape(n, size, size)
+            for axis in (0, 1):
+                occupied = inside.any(dim=2 - axis)
+                positions = torch.arange(size).expand(n, size)
+                # tensor operands, torch.where only takes scalars from torch 1.12 on
+                low = torch.where(occupied, positions, torch.full_like(positions, size)).min(dim=1).values
+                high = torch.where(occupied, positions, torch.full_like(positions, -1)).max(dim=1).values
+                # empty scenes do not move
+                still = torch.zeros_like(low)
+                low = torch.where(high >= 0, torch.clamp(-low, min=-self.max_shift), still)
+                high = torch.where(high >= 0, torch.clamp(size - 1 - high, max=self.max_shift), still)
+                shifts[:, axis] = low + (torch.rand(n, generator=self.generator) * (high - low + 1)).long()
+        return transforms.to(device), shifts.to(device)
+
+    def apply(self, grids, transforms, shifts, fill=None):
+        """
+        Transformed (n, channels, x, y, z) grids, one transform and shift per
+        row; the voxels moved in get `fill`, the largest value of their grid by default
+        """
+        n, channels, size, _, depth = grids.shape
+        key = (size, grids.device)
+        if key not in self._tables:
+            self._tables[key] = self.transform_table(size, grids.device)
+        source = self._tables[key][transforms]
+
+        # output voxel (i, j) comes from voxel (i - shift_x, j - shift_y) of the rotated and flipped grid
+        positions = torch.arange(size, device=grids.device)
+        i = positions[None, :, None] - shifts[:, 0, None, None]
+        j = positions[None, None, :] - shifts[:, 1, None, None]
+        outside = ((i < 0) | (i >= size) | (j < 0) | (j >= size)).reshape(n, -1)
+        source = source[torch.arange(n, device=grids.device)[:, None, None], i.clamp(0, size - 1),
+                        j.clamp(0, size - 1)].reshape(n, 1, -1)
+
+        # copy the z columns of all grids with one index_select
+        grid_index = torch.arange(n * channels, device=grids.device).reshape(n, channels, 1) * (size * size)
+        out = grids.reshape(-1, depth).index_select(0, (grid_index + source).reshape(-1))
+        out = out.reshape(n, channels, size * size, depth)
+
+        if outside.any():
+            if fill is None:
+                fill = grids.amax(dim=(2, 3, 4))
+            rows, columns = torch.nonzero(outside, as_tuple=True)
+            out[rows, :, columns] = fill[rows][:, :, None].to(out.dtype)
+        return out.reshape(grids.shape)
+
+    def __call__(self, batch):
+        """Augmented copy of a batch of VoxelGridLoader samples (default or packed collate)"""
+        transforms, shifts = self.sample(batch["scene"])
+        out = dict(batch)
+        for key in GRID_KEYS:
+            if key in batch:
+                fill = torch.zeros(batch[key].shape[:2], dtype=batch[key].dtype, device=batch[key].device) \
+                    if key.endswith("_occ") else None
+                out[key] = self.apply(batch[key], transforms, shifts, fill)
+
+        if any(key in batch for key in PACKED_KEYS):
+            # every object with the transform of its scene
+            counts = batch["nbr_of_objects"].to(transforms.device)
+            object_transforms = transforms.repeat_interleave(counts)
+            object_shifts = shifts.repeat_interleave(counts, dim=0)
+            for key in PACKED_KEYS:
+                if key in batch:
+                    grids = batch[key].unsqueeze(1)
+                    fill = torch.zeros(grids.shape[:2], dtype=grids.dtype, device=grids.device) \
+                        if key.endswith("_occ") else None
+                    out[key] = self.apply(grids, object_transforms, object_shifts, fill).squeeze(1)
+        return out
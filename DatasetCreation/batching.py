@@ -0,0 +1,125 @@
+"""
+Batch collates of VoxelGridLoader samples and a sampler batching scenes with
+the same number of objects
+
+Cropped object grids:
+
+    loader = VoxelGridLoader(path_to_scenes, max_n_objects, object_crops=True)
+    batches = torch.utils.data.DataLoader(loader, batch_size=8,
+                                          collate_fn=functools.partial(collate_object_crops,
+                                                                       max_n_objects=max_n_objects))
+
+The crops of a batch are pasted into one (batch, max_n_objects, *grid) buffer,
+so the full object grids are never built per sample. The batches hold the same
+keys as the default collate of the full samples.
+
+Packed object grids, without padding:
+
+    loader = VoxelGridLoader(path_to_scenes, max_n_objects=None)
+    batches = torch.utils.data.DataLoader(loader, collate_fn=collate_packed,
+                                          batch_sampler=BucketBatchSampler(loader.object_counts(), 8))
+
+The object grids of all scenes of a batch are concatenated, object j of scene b
+is packed_objects[object_offsets[b] + j].
+"""
+import random
+from collections import defaultdict
+
+import torch
+
+
+def collate_object_crops(samples, max_n_objects=None):
+    """
+    Batch of samples returned by VoxelGridLoader(..., object_crops=True); the
+    object slots beyond the objects of a scene are zero, like VoxelGridLoader pads them
+    """
+    scene = torch.stack([sample["scene"] for sample in samples])
+    n_objects = [sample["nbr_of_objects"] for sample in samples]
+    if max_n_objects is None:
+        max_n_objects = max(n_objects)
+
+    objects = torch.zeros((len(samples), max_n_objects) + scene.shape[2:], dtype=scene.dtype)
+    for b, sample in enumerate(samples):
+        objects[b, :sample["nbr_of_objects"]] = sample["object_fill"]
+        for j, (crop, offset) in enumerate(zip(sample["object_crops"], sample["object_offsets"].tolist())):
+            objects[(b, j) + tuple(slice(o, o + n) for o, n in zip(offset, crop.shape))] = crop
+
+    return {"scene": scene,
+            "scene_occ": torch.stack([sample["scene_occ"] for sample in samples]),
+            "concatenated_objects": objects,
+            "concatenated_objects_occ": (objects < 0).to(scene.dtype),
+            "nbr_of_objects": torch.tensor(n_objects)}
+
+
+def collate_packed(samples):
+    """
+    Batch with the object grids of all samples concatenated (padded grids of
+    the samples are left out), for samples of VoxelGridLoader or
+    CompactVoxelGridLoader, with full or cropped object grids
+    """
+    scene = torch.stack([sample["scene"] for sample in samples])
+    n_objects = torch.tensor([sample.get("nbr_of_objects", 0) for sample in samples])
+    offsets = torch.zeros(len(samples) + 1, dtype=torch.long)
+    offsets[1:] = torch.cumsum(n_objects, 0)
+
+    objects = torch.zeros((int(offsets[-1]),) + scene.shape[2:], dtype=scene.dtype)
+    for b, sample in enumerate(samples):
+        start, n = int(offsets[b]), int(n_objects[b])
+        if "object_crops" in sample:
+            objects[start:start + n] = sample["object_fill"]
+            for j, (crop, offset) in enumerate(zip(sample["object_crops"], sample["object_offsets"].tolist())):
+                objects[(start + j,) + tuple(slice(o, o + size) for o, size in zip(offset, crop.shape))] = crop
+        elif n > 0:
+            objects[start:start + n] = sample["concatenated_objects"][:n]
+
+    return {"scene": scene,
+            "scene_occ": (scene < 0).to(scene.dtype),
+            "packed_objects": objects,
+            "packed_objects_occ": (objects < 0).to(scene.dtype),
+            "nbr_of_objects": n_objects,
+            "object_offsets": offsets}
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    """
+    Batches of samples with the same number of objects, so that padded batches
+    (collate_object_crops without max_n_objects) waste no memory and packed
+    ones have about the same size. The samples left over in the buckets are
+    batched in the order of their number of objects. Batches and their order
+    are shuffled every epoch if `shuffle`
+    """
+
+    def __init__(self, object_counts, batch_size, shuffle=True, drop_last=False, seed=0):
+        self.buckets = defaultdict(list)
+        for i, count in enumerate(object_counts):
+            self.buckets[count].append(i)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.random = random.Random(seed)
+
+    def __iter__(self):
+        batches, leftover = [], []
+        for count in sorted(self.buckets):
+            indices = list(self.buckets[count])
+            if self.shuffle:
+                self.random.shuffle(indices)
+            n_full = len(indices) - len(indices) % self.batch_size
+            batches += [indices[k:k + self.batch_size] for k in range(0, n_full, self.batch_size)]
+            leftover += indices[n_full:]
+
+        batches += [leftover[k:k + self.batch_size] for k in range(0, len(leftover), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        if self.shuffle:
+            self.random.shuffle(batches)
+        return iter(batches)
+
+    def __len__(self):
+        n_batches, leftover = 0, 0
+        for indices in self.buckets.values():
+            n_batches += len(indices) // self.batch_size
+            leftover += len(indices) % self.batch_size
+        if self.drop_last:
+            return n_batches + leftover // self.batch_size
+        return n_batches + (leftover + self.batch_size - 1) // self.batch_size
@@ -0,0 +1,62 @@
+"""
+Builds the SDF atlas of a model library: one canonical signed distance grid per
+cad model, used by create_dataset.py --sdf_method atlas
+"""
+import os
+import sys
+import argparse
+import time
+
+# share the helper modules (metrics, ...) of the scene generator
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RandomSceneGenerator'))
+
+from helper import threads
+# limit the thread pools of every process before NumPy and friends are loaded
+threads.configure_from_argv()
+
+import trimesh
+from helper.scheduler import MemoryBudgetScheduler
+from data_loader import SuperQuadricModels
+from scene_utils.SDFAtlas import SDFAtlas
+
+
+def build_entry(cad_id, atlas_dir, resolution=128, padding=0.1):
+    cad = trimesh.load_mesh(models.get_cad_file_from_id(cad_id), process=False)
+    if isinstance(cad, trimesh.Scene):
+        cad = cad.dump(concatenate=True)
+    SDFAtlas.build_entry(cad, atlas_dir, cad_id, resolution=resolution, padding=padding)
+    print(f"built {cad_id}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument('model_dir', help='path to SQ models')
+    parser.add_argument('--atlas_dir', help='destination of the atlas (default: <model_dir>/sdf_atlas)')
+    parser.add_argument('--resolution', type=int, help='voxels along the longest side of a model', default=128)
+    parser.add_argument('--padding', type=float, help='margin around a model, relative to its longest side',
+                        default=0.1)
+    parser.add_argument('--n_processes', type=int, help='multiprocessing: number of processes', default=1)
+    parser.add_argument('--overwrite', action='store_true', help='rebuild the models already in the atlas')
+    threads.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    models = SuperQuadricModels(args.model_dir)
+    atlas_dir = args.atlas_dir or os.path.join(args.model_dir, 'sdf_atlas')
+    os.makedirs(atlas_dir, exist_ok=True)
+
+    cad_ids = [cad_id for cad_id in models.get_cad_ids()
+               if args.overwrite or not SDFAtlas.has_entry(atlas_dir, cad_id)]
+    print(f"building {len(cad_ids)} models into {atlas_dir}")
+
+    a = time.time()
+    scheduler = MemoryBudgetScheduler(max_workers=args.n_processes,
+                                      worker_init=threads.WorkerInit(args.n_processes, args.threads_per_worker,
+                                                                     args.pin))
+    scheduler.run(build_entry, [((cad_id, atlas_dir), 0) for cad_id in cad_ids],
+                  kwargs=dict(resolution=args.resolution, padding=args.padding))
+    print("time taken: ", time.time() - a)
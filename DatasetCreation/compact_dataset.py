@@ -0,0 +1,106 @@
+"""
+Compacts the tsdfs of a dataset created by create_dataset.py into a few
+memory-mapped arrays, read by data_loader.CompactVoxelGridLoader:
+
+    scenes.npy           (n_scenes, 64, 64, 64) float32 scene grids
+    objects.npy          (n_objects, 64, 64, 64) float32 per-object grids of all scenes
+    object_counts.npy    (n_scenes,) number of objects of every scene
+    object_offsets.npy   (n_scenes + 1,) index of the first object of every scene in objects.npy
+    index.json           scene folders (in this order), grid shape and largest number of objects
+
+The grids are decoded (and cropped ones inflated), so that samples are views
+of the arrays. Scenes without scene_tsdf.npy are left out. With --resolution,
+the grids of that pyramid level are compacted (downsampled from the full grids
+for scenes that do not store it).
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from scene_utils.tsdf_storage import load_object_tsdf, load_scene_tsdf, read_meta
+
+FILES = ("scenes.npy", "objects.npy", "object_counts.npy", "object_offsets.npy")
+INDEX_FILE = "index.json"
+
+
+def scene_folders(scene_dir):
+    """Complete scene folders of a dataset, sorted, and their number of object grids"""
+    folders, counts = [], []
+    for el in sorted(os.listdir(scene_dir)):
+        folder = os.path.join(scene_dir, el)
+        if not re.match(r'[0-9]', el) or not os.path.isdir(folder):
+            continue
+        names = set(os.listdir(folder))
+        if "scene_tsdf.npy" not in names:
+            print(f"skipping incomplete scene {el}")
+            continue
+        count = 0
+        while f"tsdf{count}.npy" in names:
+            count += 1
+        folders.append(el)
+        counts.append(count)
+    return folders, np.array(counts, dtype=np.int64)
+
+
+def compact(scene_dir, out_dir, resolution=None):
+    folders, counts = scene_folders(scene_dir)
+    if not folders:
+        raise IOError(f"no complete scenes in {scene_dir}")
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    shape = load_scene_tsdf(os.path.join(scene_dir, folders[0]), resolution=resolution).shape
+
+    # written under temporary names, the index last
+    if os.path.exists(os.path.join(out_dir, INDEX_FILE)):
+        os.remove(os.path.join(out_dir, INDEX_FILE))
+    temporary = {name: os.path.join(out_dir, f"{name}.tmp{os.getpid()}") for name in FILES}
+    try:
+        scenes = np.lib.format.open_memmap(temporary["scenes.npy"], mode="w+", dtype=np.float32,
+                                           shape=(len(folders),) + shape)
+        objects = np.lib.format.open_memmap(temporary["objects.npy"], mode="w+", dtype=np.float32,
+                                            shape=(int(offsets[-1]),) + shape)
+        for i, el in enumerate(folders):
+            folder = os.path.join(scene_dir, el)
+            meta = read_meta(folder)
+            scenes[i] = load_scene_tsdf(folder, meta, resolution)
+            for j in range(counts[i]):
+                objects[offsets[i] + j] = load_object_tsdf(folder, j, meta, resolution=resolution)
+        scenes.flush()
+        objects.flush()
+        del scenes, objects
+        for name, array in (("object_counts.npy", counts), ("object_offsets.npy", offsets)):
+            with open(temporary[name], "wb") as fp:
+                np.save(fp, array)
+
+        for name in FILES:
+            os.replace(temporary[name], os.path.join(out_dir, name))
+    finally:
+        for filename in temporary.values():
+            if os.path.exists(filename):
+                os.remove(filename)
+    with open(os.path.join(out_dir, INDEX_FILE), "w") as fp:
+        json.dump({"folders": folders, "shape": list(shape),
+                   "max_n_objects": int(counts.max())}, fp)
+    return len(folders), int(offsets[-1])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument('scene_dir', help='dataset created by create_dataset.py')
+    parser.add_argument('out_dir', help='destination of the compacted dataset')
+    parser.add_argument('--resolution', type=int, help='compact this pyramid level, e.g. 32 (default: full grids)')
+
+    args = parser.parse_args()
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    a = time.time()
+    n_scenes, n_objects = compact(args.scene_dir, args.out_dir, args.resolution)
+    print(f"compacted {n_scenes} scenes and {n_objects} objects into {args.out_dir}")
+    print("time taken: ", time.time() - a)
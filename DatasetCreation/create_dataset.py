@@ -2,19 +2,37 @@
 Creates a dataset from a set of pregenerated PyBullet scenes
 """
 import time
-import path
-import numpy as np
 import os
+import multiprocessing
+import sys
 import argparse
 
 import warnings
-import multiprocessing
 import shutil
+
+# share the helper modules (metrics, ...) of the scene generator
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RandomSceneGenerator'))
+
+from helper import threads
+# limit the thread pools of every process before NumPy and friends are loaded
+threads.configure_from_argv()
+
+import path
+import numpy as np
+from helper import metrics, profiling
+from helper.scheduler import MemoryBudgetScheduler
 from data_loader import PileLoader
-from scene_utils.TSDFScene import TSDFScene, create_tsdf_per_object
+from scene_utils.TSDFScene import TSDFScene, QUALITY_PRESETS, create_tsdfs_per_object
+from scene_utils.SuperQuadricSDF import SuperQuadricSDF
+from scene_utils.SDFAtlas import SDFAtlas
+from scene_utils import tsdf_storage
 
 warnings.filterwarnings("ignore")
 
+# scan: mesh_to_sdf depth scans of the meshes (OpenGL), cpu: exact mesh distances without OpenGL,
+# analytic: superquadric distance from the model parameters, atlas: resampled canonical grids (build_sdf_atlas.py)
+SDF_METHODS = ("scan", "cpu", "analytic", "atlas")
+
 def organise_folders(data_dir):
     total_folders = 0
     for el in os.listdir(data_dir):
@@ -56,7 +74,30 @@ def organise_folders(data_dir):
     print("number of valid folders: ", total_folders)
     time.sleep(2)
 
-def create_data_for_scene(i, per_instance_scene=False):
+def scene_size(i):
+    """number of objects in scene i, used to estimate its memory"""
+    try:
+        with open(os.path.join(data_loader.data[i]['scene_file'], "nbr_of_objects.txt")) as fp:
+            return int(fp.readline())
+    except (OSError, ValueError):
+        return 0
+
+
+def create_data_for_scene(i, per_instance_scene=False, metrics_dir=None, profile=0, profile_dir='profiles',
+                          track_memory=False, sdf_method="scan", object_processes=1, quality="default",
+                          encoding="float32", truncation=None, crop_objects=False, pyramid_levels=()):
+    if metrics_dir is not None:
+        metrics.enable(metrics_dir, "tsdf", memory=track_memory)
+    metrics.start_scene(data_loader.data[i]["tag"], per_instance_scene=bool(per_instance_scene),
+                        sdf_method=sdf_method, quality=quality)
+    with profiling.profile_scene(data_loader.data[i]["tag"], profile, profile_dir, "tsdf"):
+        status = _create_data_for_scene(i, per_instance_scene, sdf_method, object_processes, quality,
+                                        encoding, truncation, crop_objects, pyramid_levels)
+    metrics.end_scene(status=status)
+
+
+def _create_data_for_scene(i, per_instance_scene=False, sdf_method="scan", object_processes=1, quality="default",
+                           encoding="float32", truncation=None, crop_objects=False, pyramid_levels=()):
     tag = data_loader.data[i]["tag"]
     scene_dir = data_loader.data[i]['scene_file']
 
@@ -67,7 +108,7 @@ def create_data_for_scene(i, per_instance_scene=False):
         print("nbr_of objects file doesn't exist")
         print("deleting scene: ", tag)
         shutil.rmtree(scene_dir)
-        return
+        return "deleted"
     # if all folders exist, skip
     all_folders = True
     for j in range(nbr_of_objects):
@@ -77,41 +118,65 @@ def create_data_for_scene(i, per_instance_scene=False):
             break
     if all_folders == True and os.path.exists(os.path.join(scene_dir, "scene_tsdf.npy")):
         print("skipping scene: ", i)
-        return
+        return "skipped"
 
     print(f"saving scene {i}")
 
     try:
-        scene_info = data_loader.extract_scene_info(scene_dir)
-        scene_dict = data_loader.scenedict_from_scene_info(scene_info,
-                                                       cad_id_as_key=False)
+        with metrics.stage("mesh_load"):
+            scene_info = data_loader.extract_scene_info(scene_dir)
+            if sdf_method in ("analytic", "atlas"):
+                superquadrics = data_loader.superquadrics_from_scene_info(scene_info)
+            else:
+                scene_dict = data_loader.scenedict_from_scene_info(scene_info,
+                                                               cad_id_as_key=False)
 
     except:
         print(f"Issue with PyBullet scene: {os.path.basename(scene_dir)}")
         print("deleting scene: ", tag)
         shutil.rmtree(scene_dir)
-        return
-
-    # create scene tsdf
-    try:
-        tsdf = TSDFScene.generate_sdf_with_library(scene_dict['scene'], fixed_floor=15)
-    except:
-        print("problem creating full scene tsdf")
-        return
-
-    np.save(os.path.join(scene_dir, "scene_tsdf.npy"), tsdf)
+        return "deleted"
 
+    # create the object tsdfs, the scene tsdf comes out of the same pass
+    tsdf, per_object_tsdfs = None, None
     if per_instance_scene:
-        # create individual tsdfs
         try:
-            per_object_tsdfs = create_tsdf_per_object(scene_dict)
+            if sdf_method == "analytic":
+                tsdf, per_object_tsdfs = SuperQuadricSDF.generate_tsdfs(superquadrics, fixed_floor=15)
+            elif sdf_method == "atlas":
+                tsdf, per_object_tsdfs = sdf_atlas.generate_tsdfs(superquadrics, fixed_floor=15)
+            elif object_processes > 1:
+                with multiprocessing.Pool(min(object_processes, len(scene_dict['meshes']))) as pool:
+                    tsdf, per_object_tsdfs = create_tsdfs_per_object(scene_dict, fixed_floor=15, method=sdf_method,
+                                                                     pool=pool, quality=quality)
+            else:
+                tsdf, per_object_tsdfs = create_tsdfs_per_object(scene_dict, fixed_floor=15, method=sdf_method,
+                                                                 quality=quality)
         except:
             print("problem creating individual tsdfs")
-            return
+            tsdf, per_object_tsdfs = None, None
+
+    # create scene tsdf, on its own if there are no object tsdfs
+    if tsdf is None:
+        try:
+            if sdf_method == "analytic":
+                tsdf, _ = SuperQuadricSDF.generate_tsdfs(superquadrics, fixed_floor=15, per_object=False)
+            elif sdf_method == "atlas":
+                tsdf, _ = sdf_atlas.generate_tsdfs(superquadrics, fixed_floor=15, per_object=False)
+            else:
+                tsdf = TSDFScene.generate_sdf_with_library(scene_dict['scene'], fixed_floor=15, method=sdf_method,
+                                                           quality=quality)
+        except:
+            print("problem creating full scene tsdf")
+            return "failed_scene_tsdf"
+
+    with metrics.stage("save"):
+        tsdf_storage.save_scene(scene_dir, tsdf, per_object_tsdfs, encoding=encoding, truncation=truncation,
+                                crop_objects=crop_objects, levels=pyramid_levels)
 
-        for j in range(len(per_object_tsdfs)):
-            tsdf = per_object_tsdfs[j]
-            np.save(os.path.join(scene_dir, "tsdf" + str(j) + ".npy"), tsdf)
+    if per_instance_scene and per_object_tsdfs is None:
+        return "failed_object_tsdfs"
+    return "done"
 
 
 if __name__ == "__main__":
@@ -122,33 +187,75 @@ if __name__ == "__main__":
 
     parser.add_argument('scene_dir', help='destination path to dataset')
     parser.add_argument('model_dir', help='path to SQ models')
-    parser.add_argument('--n_processes', type=int, help='multiprocessing: number of processes', default=1)
+    parser.add_argument('--n_processes', type=int, help='multiprocessing: (maximum) number of processes '
+                                                        '(default: 1, or the number of cpus with --max_memory)')
+    parser.add_argument('--max_memory', help='start new processes only while their estimated memory fits '
+                                             'into this budget, e.g. 32G')
+    parser.add_argument('--memory_per_scene', help='memory estimate of a scene until the first ones have finished',
+                        default='2G')
     parser.add_argument('--per_instance_scene', type=bool, help='create per instance tsdf and voxelgrids')
+    parser.add_argument('--sdf_method', choices=SDF_METHODS, default='scan',
+                        help='scan the meshes with mesh_to_sdf, compute exact mesh distances on the cpu, '
+                             'evaluate the superquadrics analytically or resample the sdf atlas')
+    parser.add_argument('--atlas_dir', help='sdf atlas of --sdf_method atlas (default: <model_dir>/sdf_atlas)')
+    parser.add_argument('--quality', choices=tuple(QUALITY_PRESETS), default='default',
+                        help='accuracy and cost of the scan and cpu methods, see benchmarks/tsdf_quality.py')
+    parser.add_argument('--encoding', choices=tsdf_storage.ENCODINGS, default='float32',
+                        help='storage of the tsdfs, int8 needs --truncation')
+    parser.add_argument('--truncation', type=float,
+                        help='clip the stored tsdfs to +-truncation (world units), e.g. 0.05')
+    parser.add_argument('--crop_objects', action='store_true',
+                        help='store the per instance tsdfs cropped to the voxels below --truncation')
+    parser.add_argument('--pyramid_levels', type=int, nargs='+', default=[],
+                        help='also store the grids downsampled to these resolutions, e.g. 32 16')
+    parser.add_argument('--object_processes', type=int, default=1,
+                        help='processes computing the objects of a scene in parallel (per instance scan and cpu '
+                             'methods), on top of --n_processes')
+    parser.add_argument('--metrics_dir', help='write per-scene stage timings and counters into this folder')
+    parser.add_argument('--profile', type=float, help='fraction of the scenes to run under cProfile', default=0)
+    parser.add_argument('--profile_dir', help='folder of the per-worker profiles', default='profiles')
+    parser.add_argument('--track_memory', action='store_true',
+                        help='add per-stage peak rss and traced allocations to the metrics (needs --metrics_dir)')
+    threads.add_arguments(parser)
 
     args = parser.parse_args()
+    if args.track_memory and args.metrics_dir is None:
+        parser.error("--track_memory needs --metrics_dir")
+    try:
+        tsdf_storage.check_encoding(args.encoding, args.truncation, args.crop_objects)
+        tsdf_storage.check_levels((64, 64, 64), args.pyramid_levels)
+    except ValueError as e:
+        parser.error(str(e))
 
     data_loader = PileLoader(path_to_scenes=args.scene_dir, path_to_models=args.model_dir)
+    sdf_atlas = SDFAtlas(args.atlas_dir or os.path.join(args.model_dir, 'sdf_atlas'))
     organise_folders(data_dir=data_loader.data_path)
     # create processes
     nbr_of_processes = args.n_processes
+    if nbr_of_processes is None:
+        nbr_of_processes = os.cpu_count() if args.max_memory is not None else 1
 
     data_length = data_loader.__len__()
 
     a = time.time()
-    for batch in range(0,data_length//nbr_of_processes):
-        index_start = batch*nbr_of_processes
-        processes = [multiprocessing.Process(target=create_data_for_scene, args=(i,args.per_instance_scene)) for i in range(index_start,index_start+nbr_of_processes)]
-        [t.start() for t in processes]
-        [t.join() for t in processes]
-
-    # complete remaining folders
-    if (data_length % nbr_of_processes) != 0:
-        start =  data_length - (data_length//nbr_of_processes)*nbr_of_processes + 1
-        end = data_length
-        processes = [multiprocessing.Process(target=create_data_for_scene, args=(i,)) for i in
-                     range(start, end)]
-        [t.start() for t in processes]
-        [t.join() for t in processes]
+    scheduler = MemoryBudgetScheduler(max_workers=nbr_of_processes,
+                                      max_memory=args.max_memory,
+                                      initial_estimate=args.memory_per_scene,
+                                      worker_init=threads.WorkerInit(nbr_of_processes, args.threads_per_worker,
+                                                                     args.pin, args.object_processes))
+    jobs = [((i,), scene_size(i)) for i in range(data_length)]
+    scheduler.run(create_data_for_scene, jobs, kwargs=dict(per_instance_scene=args.per_instance_scene,
+                                                           metrics_dir=args.metrics_dir,
+                                                           profile=args.profile,
+                                                           profile_dir=args.profile_dir,
+                                                           track_memory=args.track_memory,
+                                                           sdf_method=args.sdf_method,
+                                                           object_processes=args.object_processes,
+                                                           quality=args.quality,
+                                                           encoding=args.encoding,
+                                                           truncation=args.truncation,
+                                                           crop_objects=args.crop_objects,
+                                                           pyramid_levels=args.pyramid_levels))
 
     b = time.time()
     print("time taken: " , b - a)
@@ -1,13 +1,15 @@
 import json
 import os
 import re
+import threading
+from collections import OrderedDict
 import trimesh
-import copy
-from copy import deepcopy
 import torch
 import path
 import numpy as np
 
+from scene_utils.tsdf_storage import crop_fill, load_scene_tsdf, load_object_tsdf, load_occupancy, read_meta
+
 def center_scene(meshes, transforms):
     """
     centers meshes around 0
@@ -62,10 +64,14 @@ class PileLoader:
             self.Ts_cad2cams = data['Ts_cad2cam']
             self.Ts_cam2world = data['T_cam2world']
 
-    def __init__(self, path_to_scenes, path_to_models):
+    def __init__(self, path_to_scenes, path_to_models, mesh_cache_size=256):
 
         self.path_to_models = path_to_models
         self.models = SuperQuadricModels(path_to_models)
+        # parsed cad meshes and exponents by cad id, least recently used first
+        self.mesh_cache_size = mesh_cache_size
+        self._mesh_cache = OrderedDict()
+        self._mesh_cache_lock = threading.Lock()
 
         # load all folders
         folder_list = []
@@ -94,6 +100,28 @@ class PileLoader:
         return PileLoader.SceneInfo(data)
 
 
+    def cad_from_id(self, cad_id):
+        """
+        Unscaled cad mesh and exponents of a model, parsed once and cached; the
+        mesh is shared, copy it before changing it
+        """
+        with self._mesh_cache_lock:
+            if cad_id in self._mesh_cache:
+                self._mesh_cache.move_to_end(cad_id)
+                return self._mesh_cache[cad_id]
+
+        with open(str(self.models.get_parameters_from_id(cad_id))) as json_file:
+            exponents = json.loads(json.load(json_file)['exponents'])
+        cad = trimesh.load_mesh(self.models.get_cad_file_from_id(cad_id), process=False)
+        if isinstance(cad, trimesh.Scene):
+            cad = cad.dump(concatenate=True)
+
+        with self._mesh_cache_lock:
+            self._mesh_cache[cad_id] = (cad, exponents)
+            while len(self._mesh_cache) > self.mesh_cache_size:
+                self._mesh_cache.popitem(last=False)
+        return cad, exponents
+
     def scenedict_from_scene_info(self,
                         scene_info: SceneInfo,
                         cad_id_as_key=True):
@@ -107,13 +135,6 @@ class PileLoader:
         Ts_cam2world = scene_info.Ts_cam2world
 
 
-        #load exponents from models
-        exponents_dict = {}
-        for cad_id in cad_ids:
-            with open(str((path.Path(self.models.data_dir) / 'parameters' / (cad_id + '.json')))) as json_file:
-                parameter_file = json.load(json_file)
-                exponents_dict[cad_id] = json.loads(parameter_file['exponents'])
-
         transforms = {}
         meshes = {}
         unscaled_meshes = {}
@@ -129,19 +150,16 @@ class PileLoader:
             transform = Ts_cam2world @ Ts_cad2cam
             transforms[object_id] = transform
 
-            # cad
-            cad_file = self.models.get_cad_file_from_id(cad_id)
-            cad = trimesh.load_mesh(cad_file, process=False)
-            if isinstance(cad, trimesh.Scene):
-                cad = cad.dump(concatenate=True)
-
-            unscaled_meshes[object_id] = deepcopy(cad)
+            # cad, from the cache
+            cached_cad, cad_exponents = self.cad_from_id(cad_id)
+            unscaled_meshes[object_id] = cached_cad.copy()
+            cad = cached_cad.copy()
 
             cad.vertices *= scale
 
             meshes[object_id] = cad
             mesh_scales[object_id] = scale
-            exponents[object_id] = exponents_dict[cad_id]
+            exponents[object_id] = cad_exponents
 
             scene.add_geometry(cad, geom_name=object_id, transform=transform)
 
@@ -154,6 +172,24 @@ class PileLoader:
 
         return scene_dict
 
+    def superquadrics_from_scene_info(self, scene_info: SceneInfo):
+        """
+        Parameters and world poses of the superquadrics of a scene, in the order
+        of scenedict_from_scene_info, without loading their meshes
+        """
+        Ts_cam2world = scene_info.Ts_cam2world
+
+        superquadrics = []
+        for cad_id, scale, Ts_cad2cam in zip(scene_info.cad_ids, scene_info.scales, scene_info.Ts_cad2cams):
+            with open(str(self.models.get_parameters_from_id(cad_id))) as json_file:
+                parameter_file = json.load(json_file)
+            superquadrics.append({'cad_id': cad_id,
+                                  'scales': np.asarray(json.loads(parameter_file['scales']), dtype=float),
+                                  'exponents': np.asarray(json.loads(parameter_file['exponents']), dtype=float),
+                                  'mesh_scale': np.asarray(scale, dtype=float),
+                                  'transform': Ts_cam2world @ Ts_cad2cam})
+        return superquadrics
+
     def init_files(self, scene_list):
         "Creates the list of dataset samples. Every dataset sample is a data item dictionary"
         scenes = []
@@ -184,7 +220,7 @@ class PileLoader:
 
         T_to_center = center_scene(gt_meshes, gt_transforms)
         for nbr, (mesh, transf) in enumerate(zip(gt_meshes, T_to_center)):
-            meshc = copy.deepcopy(mesh)
+            meshc = mesh.copy()
             mesh.apply_scale(64)
             mesh.apply_transform(mesh.principal_inertia_transform)
             meshes.append(mesh)
@@ -210,9 +246,18 @@ class PileLoader:
 
 class VoxelGridLoader:
     """
-
+    With object_crops, the samples hold the stored (cropped) object grids and
+    their offsets instead of the padded full grids, see batching.collate_object_crops.
+    With occupancy_only, they only hold the occupancy grids, as occupancy_dtype,
+    read from occupancy.npy without loading the tsdfs. With max_n_objects None
+    the object grids are not padded (see batching.collate_packed). With a
+    materializer (materialize.TSDFMaterializer), the grids of scenes without
+    them are computed on first access instead of raising an IOError. With a
+    resolution (e.g. 32), the grids of that pyramid level are loaded, downsampled
+    from the full grids if the dataset does not store it
     """
-    def __init__(self, path_to_scenes, max_n_objects):
+    def __init__(self, path_to_scenes, max_n_objects, object_crops=False, occupancy_only=False,
+                 occupancy_dtype=torch.bool, materializer=None, resolution=None):
 
         # load all folders
         folder_list = []
@@ -224,6 +269,11 @@ class VoxelGridLoader:
 
         self.folder_list = folder_list
         self.max_n_objects = max_n_objects
+        self.object_crops = object_crops
+        self.occupancy_only = occupancy_only
+        self.occupancy_dtype = occupancy_dtype
+        self.materializer = materializer
+        self.resolution = resolution
 
     def __len__(self):
         return len(self.folder_list)
@@ -233,48 +283,139 @@ class VoxelGridLoader:
         folder = self.folder_list[i]
 
         scene_file = os.path.join(folder, "scene_tsdf.npy")
+        if self.materializer is not None:
+            self.materializer.ensure(folder)
         if not os.path.exists(scene_file):
             raise IOError(f"scene file {scene_file} doesn't exist")
+        meta = read_meta(folder)
+        if self.occupancy_only:
+            return self._occupancy_sample(folder, meta)
+
         # load scene tsdf and create scene occupancy grid
-        scene_tsdf = np.load(os.path.join(folder, "scene_tsdf.npy"))
-        scene_occ = np.zeros_like(scene_tsdf)
-        scene_occ[scene_tsdf < 0] = 1
-
-        tsdfs = []
-        occs = []
-        # extract number of objects
-        nbr_of_objects = 0;
-
-        while os.path.exists(os.path.join(folder, "tsdf" + str(nbr_of_objects) + ".npy")):
-            tsdf = np.load(os.path.join(folder, "tsdf" + str(nbr_of_objects) + ".npy"))
-            nbr_of_objects += 1
-            tsdfs.append(tsdf)
-            occ = np.zeros_like(tsdf)
-            occ[tsdf < 0] = 1
-            occs.append(occ)
+        scene_tsdf = load_scene_tsdf(folder, meta, self.resolution)
+        scene_occ = (scene_tsdf < 0).astype(scene_tsdf.dtype)
+
+        if self.object_crops:
+            return self._crop_sample(folder, meta, scene_tsdf, scene_occ)
+
+        tsdfs = [load_object_tsdf(folder, j, meta, resolution=self.resolution)
+                 for j in range(self._n_object_files(folder))]
+        nbr_of_objects = len(tsdfs)
 
         sample = {"scene": torch.from_numpy(scene_tsdf).unsqueeze(0),
                   "scene_occ": torch.from_numpy(scene_occ).unsqueeze(0)}
 
         if nbr_of_objects > 0:
-            # concatenate tsdfs
-            concatenated_tsdfs = torch.cat([torch.from_numpy(el).unsqueeze(0) for el in tsdfs], dim=0)
+            # concatenate tsdfs, with empty scenes for datasets with varying number of objects
+            concatenated_tsdfs = torch.zeros((self._padded_length(nbr_of_objects),) + tsdfs[0].shape,
+                                             dtype=torch.from_numpy(tsdfs[0]).dtype)
+            for j, tsdf in enumerate(tsdfs):
+                concatenated_tsdfs[j] = torch.from_numpy(tsdf)
+            concatenated_occs = (concatenated_tsdfs < 0).to(concatenated_tsdfs.dtype)
 
-            # add empty scenes if necessary (for datasets with varying number of objects)
-            for i in range(self.max_n_objects - concatenated_tsdfs.shape[0]):
-                concatenated_tsdfs = torch.cat(
-                    [concatenated_tsdfs, torch.zeros_like(concatenated_tsdfs[0].unsqueeze(0))], dim=0)
+            sample.update({"concatenated_objects": concatenated_tsdfs,
+                      "concatenated_objects_occ": concatenated_occs,
+                      "nbr_of_objects": nbr_of_objects})
+
+        return sample
+
+    def object_counts(self):
+        """Number of object grids of every sample, e.g. for batching.BucketBatchSampler"""
+        return [self._n_object_files(folder) for folder in self.folder_list]
+
+    def _padded_length(self, nbr_of_objects):
+        if self.max_n_objects is None:
+            return nbr_of_objects
+        return max(self.max_n_objects, nbr_of_objects)
+
+    @classmethod
+    def _n_object_files(cls, folder):
+        """Number of consecutive tsdfN.npy files, from one listing of the folder"""
+        names = set(os.listdir(folder))
+        n = 0
+        while "tsdf" + str(n) + ".npy" in names:
+            n += 1
+        return n
+
+    def _crop_sample(self, folder, meta, scene_tsdf, scene_occ):
+        crops, offsets = [], []
+        for j in range(self._n_object_files(folder)):
+            crop, offset = load_object_tsdf(folder, j, meta, crop=True, resolution=self.resolution)
+            crops.append(torch.from_numpy(crop))
+            offsets.append(offset)
+
+        return {"scene": torch.from_numpy(scene_tsdf).unsqueeze(0),
+                "scene_occ": torch.from_numpy(scene_occ).unsqueeze(0),
+                "object_crops": crops,
+                "object_offsets": torch.tensor(offsets, dtype=torch.long).reshape(-1, scene_tsdf.ndim),
+                "object_fill": crop_fill(meta),
+                "nbr_of_objects": len(crops)}
+
+    def _occupancy_sample(self, folder, meta):
+        occupancy = load_occupancy(folder, meta, self.resolution)
+        if occupancy is None:
+            # datasets without occupancy.npy (of the level)
+            grids = [load_scene_tsdf(folder, meta, self.resolution)]
+            grids += [load_object_tsdf(folder, j, meta, resolution=self.resolution)
+                      for j in range(self._n_object_files(folder))]
+            occupancy = np.stack(grids) < 0
+        occupancy = torch.from_numpy(occupancy).to(self.occupancy_dtype)
+
+        nbr_of_objects = len(occupancy) - 1
+        sample = {"scene_occ": occupancy[:1]}
+        if nbr_of_objects > 0:
+            # padded with empty grids like the tsdfs
+            objects_occ = torch.zeros((self._padded_length(nbr_of_objects),) + occupancy.shape[1:],
+                                      dtype=self.occupancy_dtype)
+            objects_occ[:nbr_of_objects] = occupancy[1:]
+            sample.update({"concatenated_objects_occ": objects_occ,
+                           "nbr_of_objects": nbr_of_objects})
+        return sample
+
+
+class CompactVoxelGridLoader:
+    """
+    Samples of a dataset compacted by compact_dataset.py, with the keys of
+    VoxelGridLoader. The grids are views of the memory-mapped arrays (copy on
+    write), only the padding to max_n_objects (if given) and the occupancy
+    (if occupancy) are computed per sample
+    """
+    def __init__(self, path_to_compact, max_n_objects=None, occupancy=True):
+        with open(os.path.join(path_to_compact, "index.json")) as fp:
+            self.index = json.load(fp)
+        # names of the scene folders the samples were compacted from
+        self.folders = self.index["folders"]
+        self.scenes = np.load(os.path.join(path_to_compact, "scenes.npy"), mmap_mode='c')
+        self.objects = np.load(os.path.join(path_to_compact, "objects.npy"), mmap_mode='c')
+        self.object_offsets = np.load(os.path.join(path_to_compact, "object_offsets.npy"))
+        self.max_n_objects = max_n_objects
+        self.occupancy = occupancy
+
+    def __len__(self):
+        return len(self.scenes)
 
-            # concatenate occs
-            concatenated_occs = torch.cat([torch.from_numpy(el).unsqueeze(0) for el in occs], dim=0)
+    def object_counts(self):
+        """Number of object grids of every sample, e.g. for batching.BucketBatchSampler"""
+        return np.diff(self.object_offsets).tolist()
 
-            # add empty scenes if necessary (for datasets with varying number of objects)
-            for i in range(self.max_n_objects - concatenated_occs.shape[0]):
-                concatenated_occs = torch.cat(
-                    [concatenated_occs, torch.zeros_like(concatenated_occs[0].unsqueeze(0))], dim=0)
+    def __getitem__(self, i):
+        scene_tsdf = torch.from_numpy(self.scenes[i]).unsqueeze(0)
+        sample = {"scene": scene_tsdf}
+        if self.occupancy:
+            sample["scene_occ"] = (scene_tsdf < 0).to(scene_tsdf.dtype)
 
+        start, stop = self.object_offsets[i], self.object_offsets[i + 1]
+        nbr_of_objects = int(stop - start)
+        if nbr_of_objects > 0:
+            concatenated_tsdfs = torch.from_numpy(self.objects[start:stop])
+            if self.max_n_objects is not None and self.max_n_objects > nbr_of_objects:
+                padded = torch.zeros((self.max_n_objects,) + concatenated_tsdfs.shape[1:],
+                                     dtype=concatenated_tsdfs.dtype)
+                padded[:nbr_of_objects] = concatenated_tsdfs
+                concatenated_tsdfs = padded
             sample.update({"concatenated_objects": concatenated_tsdfs,
-                      "concatenated_objects_occ": concatenated_occs,
-                      "nbr_of_objects": nbr_of_objects})
+                           "nbr_of_objects": nbr_of_objects})
+            if self.occupancy:
+                sample["concatenated_objects_occ"] = (concatenated_tsdfs < 0).to(concatenated_tsdfs.dtype)
 
-        return sample
\ No newline at end of file
+        return sample
@@ -0,0 +1,80 @@
+"""
+Computes the tsdfs of scenes on demand, e.g. for VoxelGridLoader(..., materializer=...)
+on a dataset that create_dataset.py has not (completely) run on
+
+    materializer = TSDFMaterializer(path_to_scenes, path_to_models, sdf_method="atlas")
+    loader = VoxelGridLoader(path_to_scenes, max_n_objects, materializer=materializer)
+
+A scene without scene_tsdf.npy gets its scene and per-object grids computed
+from pybullet_scene_info (organised by create_dataset.py) on first access and
+written into its folder (tsdf_storage writes scene_tsdf.npy last, so it marks
+a complete scene). An exclusive lock file per scene keeps DataLoader workers
+from computing the same scene at the same time: the others wait for it and
+then read the grids.
+"""
+import fcntl
+import os
+import sys
+
+# the sdf methods use the helper modules of the scene generator
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RandomSceneGenerator'))
+
+from data_loader import PileLoader
+from scene_utils import tsdf_storage
+from scene_utils.SDFAtlas import SDFAtlas
+from scene_utils.SuperQuadricSDF import SuperQuadricSDF
+from scene_utils.TSDFScene import create_tsdfs_per_object
+
+LOCK_FILE = ".tsdf.lock"
+
+
+def scene_tsdfs(data_loader, scene_dir, sdf_method="analytic", sdf_atlas=None, quality="default"):
+    """Scene grid and per-object grids of a scene, as create_dataset.py computes them"""
+    scene_info = data_loader.extract_scene_info(scene_dir)
+    if sdf_method == "analytic":
+        return SuperQuadricSDF.generate_tsdfs(data_loader.superquadrics_from_scene_info(scene_info), fixed_floor=15)
+    if sdf_method == "atlas":
+        return sdf_atlas.generate_tsdfs(data_loader.superquadrics_from_scene_info(scene_info), fixed_floor=15)
+    scene_dict = data_loader.scenedict_from_scene_info(scene_info, cad_id_as_key=False)
+    return create_tsdfs_per_object(scene_dict, fixed_floor=15, method=sdf_method, quality=quality)
+
+
+class TSDFMaterializer:
+
+    def __init__(self, path_to_scenes, path_to_models, sdf_method="analytic", atlas_dir=None, quality="default",
+                 encoding="float32", truncation=None, crop_objects=False, pyramid_levels=()):
+        """Arguments as the options of create_dataset.py"""
+        tsdf_storage.check_encoding(encoding, truncation, crop_objects)
+        tsdf_storage.check_levels((64, 64, 64), pyramid_levels)
+        self.data_loader = PileLoader(path_to_scenes, path_to_models)
+        self.sdf_atlas = SDFAtlas(atlas_dir or os.path.join(path_to_models, 'sdf_atlas')) \
+            if sdf_method == "atlas" else None
+        self.sdf_method = sdf_method
+        self.quality = quality
+        self.encoding = encoding
+        self.truncation = truncation
+        self.crop_objects = crop_objects
+        self.pyramid_levels = pyramid_levels
+
+    def ensure(self, scene_dir):
+        """Computes the grids of the scene unless they exist, returns whether it did"""
+        scene_file = os.path.join(scene_dir, "scene_tsdf.npy")
+        if os.path.exists(scene_file):
+            return False
+        if not os.path.isdir(os.path.join(scene_dir, "pybullet_scene_info")):
+            raise IOError(f"scene {scene_dir} has neither tsdfs nor pybullet_scene_info")
+
+        with open(os.path.join(scene_dir, LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # computed by another process while this one waited
+                if os.path.exists(scene_file):
+                    return False
+                scene_tsdf, object_tsdfs = scene_tsdfs(self.data_loader, scene_dir, self.sdf_method,
+                                                       self.sdf_atlas, self.quality)
+                tsdf_storage.save_scene(scene_dir, scene_tsdf, object_tsdfs, encoding=self.encoding,
+                                        truncation=self.truncation, crop_objects=self.crop_objects,
+                                        levels=self.pyramid_levels)
+                return True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
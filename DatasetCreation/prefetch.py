@@ -0,0 +1,113 @@
+"""
+Read-ahead of map-style datasets (PileLoader, VoxelGridLoader,
+CompactVoxelGridLoader) on a thread pool
+
+    for sample in Prefetcher(VoxelGridLoader(path_to_scenes, 8), window=16, n_threads=4):
+        ...
+
+keeps the samples of the next `window` indices loading while the current one
+is used. The file reads (np.load, trimesh) release the GIL, so a few threads
+overlap them with the training step. In torch DataLoader workers, wrap the
+dataset in PrefetchingDataset, which splits the indices between the workers
+and prefetches in every worker:
+
+    loader = DataLoader(PrefetchingDataset(dataset, RandomSampler(dataset)), batch_size=8, num_workers=2)
+
+stats() reports how often and how long the consumer waited for a sample.
+"""
+import collections
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+class Prefetcher:
+
+    def __init__(self, dataset, indices=None, window=8, n_threads=4):
+        """`indices` is any iterable of indices (e.g. a torch Sampler), all of the dataset by default"""
+        self.dataset = dataset
+        self.indices = indices
+        self.window = window
+        self.n_threads = n_threads
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._stats = {"samples": 0, "stalls": 0, "stall_seconds": 0.0, "ready": 0, "wall_seconds": 0.0}
+
+    def stats(self):
+        """
+        samples: samples delivered, stalls: samples that were not loaded yet when
+        requested, stall_seconds: time spent waiting for them, mean_ready: mean
+        number of loaded samples in the window (queue depth) when one was requested
+        """
+        stats = dict(self._stats)
+        samples = max(stats["samples"], 1)
+        stats["mean_ready"] = stats.pop("ready") / samples
+        stats["stall_fraction"] = stats["stall_seconds"] / stats["wall_seconds"] if stats["wall_seconds"] else 0.0
+        return stats
+
+    def __iter__(self):
+        indices = iter(range(len(self.dataset)) if self.indices is None else self.indices)
+        # created per iteration, so that a prefetcher built before a fork works in the child
+        executor = ThreadPoolExecutor(self.n_threads, thread_name_prefix="prefetch")
+        pending = collections.deque()
+        try:
+            for i in indices:
+                pending.append(executor.submit(self.dataset.__getitem__, i))
+                if len(pending) >= self.window:
+                    break
+
+            start = time.perf_counter()
+            while pending:
+                future = pending.popleft()
+                self._stats["ready"] += future.done() + sum(f.done() for f in pending)
+                if not future.done():
+                    self._stats["stalls"] += 1
+                    wait = time.perf_counter()
+                    sample = future.result()
+                    self._stats["stall_seconds"] += time.perf_counter() - wait
+                else:
+                    sample = future.result()
+                for i in indices:
+                    pending.append(executor.submit(self.dataset.__getitem__, i))
+                    break
+                self._stats["samples"] += 1
+                self._stats["wall_seconds"] = time.perf_counter() - start
+                yield sample
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+
+class PrefetchingDataset(torch.utils.data.IterableDataset):
+    """
+    Iterable dataset over a map-style dataset, prefetched with a Prefetcher;
+    in DataLoader workers every worker loads every num_workers-th index
+    """
+
+    def __init__(self, dataset, indices=None, window=8, n_threads=4, report_every=0):
+        self.dataset = dataset
+        self.indices = indices
+        self.window = window
+        self.n_threads = n_threads
+        # print the prefetch stats of every worker every `report_every` samples
+        self.report_every = report_every
+
+    def __len__(self):
+        return len(self.dataset) if self.indices is None else len(self.indices)
+
+    def __iter__(self):
+        indices = list(range(len(self.dataset)) if self.indices is None else self.indices)
+        worker_info = torch.utils.data.get_worker_info()
+        worker = 0
+        if worker_info is not None:
+            worker = worker_info.id
+            indices = indices[worker_info.id::worker_info.num_workers]
+
+        prefetcher = Prefetcher(self.dataset, indices, self.window, self.n_threads)
+        for n, sample in enumerate(prefetcher, start=1):
+            if self.report_every and n % self.report_every == 0:
+                print(f"prefetch worker {worker}: {prefetcher.stats()}")
+            yield sample
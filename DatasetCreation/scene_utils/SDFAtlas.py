@@ -0,0 +1,158 @@
+"""
+Atlas of canonical signed distance grids, one per cad model, and the scene and
+per-object grids resampled from it
+
+Every model gets a grid in its cad frame (isotropic spacing, `resolution`
+voxels along the longest side of its bounding box plus `padding` on every
+side), written by build_sdf_atlas.py as
+
+    <atlas_dir>/<cad_id>.npy    canonical grid (float32), memory-mapped when read
+    <atlas_dir>/<cad_id>.json   origin, spacing and the convex hull vertices
+
+An object with per-axis scale s and pose (R, t) maps a world point p to
+q = R^T (p - t) / s in the cad frame. Its distance is taken as
+
+    d(p) = d_c(q) / |n / s|    outside,    d(p) = s_min d_c(q)    inside
+
+with d_c the trilinear interpolation of the canonical grid and n its unit
+gradient; the first is exact for planar surfaces. Scaling stretches distances
+by at least s_min and at most s_max, and 1 / |n / s| lies in between, so the
+sign is exact and the error is at most (s_max - s_min) |d_c(q)|: zero on the
+surface, growing with the distance and the anisotropy of the scale.
+Trilinear interpolation adds at most half a canonical voxel diagonal
+(sqrt(3) / 2 spacing), times s_max. Points outside of the canonical grid get
+the distance of the closest grid point plus the world distance to it, an
+upper bound.
+"""
+import json
+import os
+
+import numpy as np
+
+from helper import metrics
+from scene_utils.MeshSDF import MeshSDF
+from scene_utils.SuperQuadricSDF import SuperQuadricSDF
+from scene_utils.TSDFScene import TSDFScene
+
+
+class SDFAtlas:
+
+    def __init__(self, atlas_dir):
+        self.atlas_dir = atlas_dir
+        self._entries = {}
+
+    @classmethod
+    def build_entry(cls, mesh, atlas_dir, cad_id, resolution=128, padding=0.1):
+        """
+        Writes the canonical grid of the (unscaled) cad mesh, `padding` is relative
+        to the longest side of the bounding box
+        """
+        vertices = np.asarray(mesh.vertices, dtype=float)
+        low, high = vertices.min(axis=0), vertices.max(axis=0)
+        margin = padding * (high - low).max()
+        low, high = low - margin, high + margin
+        spacing = (high - low).max() / (resolution - 1)
+        axes = [low[i] + spacing * np.arange(int(np.ceil((high[i] - low[i]) / spacing)) + 1) for i in range(3)]
+
+        grid = MeshSDF.signed_distances(np.asarray(mesh.triangles, dtype=float), axes).astype(np.float32)
+
+        hull = mesh.convex_hull.vertices
+        np.save(os.path.join(atlas_dir, f"{cad_id}.npy"), grid)
+        # the metadata last, an entry without it is incomplete
+        with open(os.path.join(atlas_dir, f"{cad_id}.json"), "w") as fp:
+            json.dump({'origin': low.tolist(), 'spacing': float(spacing), 'shape': list(grid.shape),
+                       'hull_vertices': np.asarray(hull).tolist()}, fp)
+
+    @classmethod
+    def has_entry(cls, atlas_dir, cad_id):
+        return all(os.path.exists(os.path.join(atlas_dir, f"{cad_id}.{extension}")) for extension in ("npy", "json"))
+
+    def entry(self, cad_id):
+        """Memory-mapped canonical grid and metadata of a cad model, opened once per process"""
+        if cad_id not in self._entries:
+            with open(os.path.join(self.atlas_dir, f"{cad_id}.json")) as fp:
+                meta = json.load(fp)
+            meta['origin'] = np.asarray(meta['origin'])
+            meta['hull_vertices'] = np.asarray(meta['hull_vertices'])
+            grid = np.load(os.path.join(self.atlas_dir, f"{cad_id}.npy"), mmap_mode='r')
+            self._entries[cad_id] = (grid, meta)
+        return self._entries[cad_id]
+
+    def scene_center(self, objects):
+        """Center of the bounding box of the world space meshes, from their convex hulls"""
+        points = []
+        for obj in objects:
+            _, meta = self.entry(obj['cad_id'])
+            transform = obj['transform']
+            points.append((meta['hull_vertices'] * obj['mesh_scale']) @ transform[:3, :3].T + transform[:3, 3])
+        points = np.concatenate(points)
+        return (points.min(axis=0) + points.max(axis=0)) / 2
+
+    @classmethod
+    def trilinear(cls, grid, index):
+        """
+        Trilinear interpolation of the grid at the (N, 3) continuous indices
+        (inside the grid) and its gradient, in index units
+        """
+        base = np.minimum(np.floor(index).astype(int), np.array(grid.shape) - 2)
+        x, y, z = (index - base).T
+        i, j, k = base.T
+        c = np.empty((2, 2, 2, len(index)))
+        for di in (0, 1):
+            for dj in (0, 1):
+                for dk in (0, 1):
+                    c[di, dj, dk] = grid[i + di, j + dj, k + dk]
+        # interpolate along z, then y, then x
+        cz = c[:, :, 0] * (1 - z) + c[:, :, 1] * z
+        cyz = cz[:, 0] * (1 - y) + cz[:, 1] * y
+        value = cyz[0] * (1 - x) + cyz[1] * x
+        dz = c[:, :, 1] - c[:, :, 0]
+        dz = dz[:, 0] * (1 - y) + dz[:, 1] * y
+        dy = cz[:, 1] - cz[:, 0]
+        gradient = np.stack([cyz[1] - cyz[0],
+                             dy[0] * (1 - x) + dy[1] * x,
+                             dz[0] * (1 - x) + dz[1] * x], axis=1)
+        return value, gradient
+
+    def object_sdf(self, obj, points, voxel_res=64):
+        """Distance of the (N, 3) world points to an object, as a (voxel_res,) * 3 grid"""
+        grid, meta = self.entry(obj['cad_id'])
+        scale = np.broadcast_to(np.asarray(obj['mesh_scale'], dtype=float), (3,))
+        transform = obj['transform']
+        # world -> cad frame: R^T (p - t) / s, as row vectors
+        local = ((points - transform[:3, 3]) @ transform[:3, :3]) / scale
+
+        index = (local - meta['origin']) / meta['spacing']
+        clamped = np.clip(index, 0, np.array(grid.shape) - 1)
+        # world length of the way to the grid
+        outside = np.linalg.norm((index - clamped) * meta['spacing'] * scale, axis=1)
+        distance, gradient = self.trilinear(grid, clamped)
+
+        # a plane with normal n in the cad frame is 1 / |n / s| times as far in the world,
+        # inside the closest surface changes too quickly for that
+        norm = np.linalg.norm(gradient, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stretch = 1 / np.linalg.norm(gradient / norm[:, None] / scale, axis=1)
+        stretch = np.where((norm > 0) & (distance > 0), stretch, scale.min())
+        return (stretch * distance + outside).reshape(voxel_res, voxel_res, voxel_res)
+
+    def generate_tsdfs(self, objects, fixed_floor=15, per_object=True, voxel_res=64):
+        """
+        Scene grid as the union (minimum) of the resampled object grids and, if
+        `per_object`, the object grids, moved by the same rows; `objects` as
+        returned by PileLoader.superquadrics_from_scene_info
+        """
+        with metrics.stage("atlas_resample"):
+            points = SuperQuadricSDF.grid_points(self.scene_center(objects), voxel_res)
+            object_sdfs = [self.object_sdf(obj, points, voxel_res).astype(np.float32) for obj in objects]
+            scene_sdf = np.min(object_sdfs, axis=0)
+
+        with metrics.stage("floor_shift"):
+            rows = TSDFScene.fixed_floor_shift(scene_sdf, fixed_floor)
+            scene_sdf = TSDFScene.move_by_fixed_amount(scene_sdf, rows)
+            if per_object:
+                object_sdfs = [TSDFScene.move_by_fixed_amount(sdf, rows) for sdf in object_sdfs]
+
+        if not per_object:
+            object_sdfs = None
+        return scene_sdf, object_sdfs
@@ -0,0 +1,115 @@
+"""
+Signed distance grids of superquadric scenes evaluated directly from the
+superquadric parameters, without meshes, OpenGL scans or voxelization
+
+A superquadric with semi-axes (a1, a2, a3) and exponents (e1, e2) is the
+zero level of the inside-outside function
+
+    F(x, y, z) = (|x/a1|^(2/e2) + |y/a2|^(2/e2))^(e2/e1) + |z/a3|^(2/e1)
+
+in the cad frame. The signed distance is approximated by the radial distance
+|p| (1 - F^(-e1/2)), which is exact on the surface and along rays from the
+center, negative inside and grows with the Euclidean distance outside.
+
+The grids use the layout of TSDFScene.generate_sdf_with_library: 64^3 voxels
+spanning a cube of side 1 around the center of the scene bounding box, values
+in world units, moved so that the lowest inside row is at `fixed_floor`.
+"""
+import numpy as np
+
+from helper import metrics
+from scene_utils.TSDFScene import TSDFScene
+
+
+class SuperQuadricSDF:
+
+    @classmethod
+    def inside_outside(cls, points, scales, exponents):
+        """F of (N, 3) points in the cad frame, < 1 inside and > 1 outside"""
+        e1, e2 = exponents
+        x, y, z = np.abs(points / scales).T
+        xy = (x ** (2 / e2) + y ** (2 / e2)) ** (e2 / e1)
+        return xy + z ** (2 / e1)
+
+    @classmethod
+    def radial_distance(cls, points, scales, exponents):
+        """Approximate signed distance of (N, 3) points in the cad frame"""
+        norm = np.linalg.norm(points, axis=1)
+        with np.errstate(divide='ignore', over='ignore'):
+            f = np.maximum(cls.inside_outside(points, scales, exponents), 1e-12)
+            distance = norm * (1 - f ** (-exponents[0] / 2))
+        # the center itself is a minimum semi-axis deep
+        distance[norm < 1e-12] = -np.min(scales)
+        return distance
+
+    @classmethod
+    def surface_points(cls, scales, exponents, n_eta=32, n_omega=64):
+        """Points of the parametric surface in the cad frame, including the extreme points of every axis"""
+        e1, e2 = exponents
+        eta, omega = np.meshgrid(np.linspace(-np.pi / 2, np.pi / 2, n_eta + 1),
+                                 np.linspace(-np.pi, np.pi, n_omega + 1))
+
+        def signed_power(x, exponent):
+            return np.sign(x) * np.abs(x) ** exponent
+
+        points = np.stack([
+            scales[0] * signed_power(np.cos(eta), e1) * signed_power(np.cos(omega), e2),
+            scales[1] * signed_power(np.cos(eta), e1) * signed_power(np.sin(omega), e2),
+            scales[2] * signed_power(np.sin(eta), e1),
+        ], axis=-1)
+        return points.reshape(-1, 3)
+
+    @classmethod
+    def _world_axes(cls, superquadric):
+        """semi-axes after the mesh scale and the cad to world transformation"""
+        scales = superquadric['scales'] * superquadric['mesh_scale']
+        transform = superquadric['transform']
+        return scales, transform[:3, :3], transform[:3, 3]
+
+    @classmethod
+    def scene_center(cls, superquadrics):
+        """Center of the bounding box of the scene, like the joint mesh centroid of the scan method"""
+        points = []
+        for superquadric in superquadrics:
+            scales, R, t = cls._world_axes(superquadric)
+            points.append(cls.surface_points(scales, superquadric['exponents']) @ R.T + t)
+        points = np.concatenate(points)
+        return (points.min(axis=0) + points.max(axis=0)) / 2
+
+    @classmethod
+    def grid_points(cls, center, voxel_res=64):
+        """World coordinates of the voxel centers as (voxel_res ** 3, 3), in [ix, iy, iz] order"""
+        lin = np.linspace(-1, 1, voxel_res) / 2
+        grid = np.stack(np.meshgrid(lin, lin, lin, indexing='ij'), axis=-1).reshape(-1, 3)
+        return grid + center
+
+    @classmethod
+    def object_sdf(cls, superquadric, points, voxel_res=64):
+        scales, R, t = cls._world_axes(superquadric)
+        # world -> cad frame: R^T (p - t), as row vectors
+        local = (points - t) @ R
+        distance = cls.radial_distance(local, scales, superquadric['exponents'])
+        return distance.reshape(voxel_res, voxel_res, voxel_res)
+
+    @classmethod
+    def generate_tsdfs(cls, superquadrics, fixed_floor=15, per_object=True, voxel_res=64):
+        """
+        Scene grid as the union (minimum) of the object grids and, if
+        `per_object`, the object grids in the same frame, moved by the same rows
+        """
+        with metrics.stage("analytic_sdf"):
+            points = cls.grid_points(cls.scene_center(superquadrics), voxel_res)
+            # float64 for the powers, float32 like the other methods afterwards
+            object_sdfs = [cls.object_sdf(superquadric, points, voxel_res).astype(np.float32)
+                           for superquadric in superquadrics]
+            scene_sdf = np.min(object_sdfs, axis=0)
+
+        with metrics.stage("floor_shift"):
+            rows = TSDFScene.fixed_floor_shift(scene_sdf, fixed_floor)
+            scene_sdf = TSDFScene.move_by_fixed_amount(scene_sdf, rows)
+            if per_object:
+                object_sdfs = [TSDFScene.move_by_fixed_amount(sdf, rows) for sdf in object_sdfs]
+
+        if not per_object:
+            object_sdfs = None
+        return scene_sdf, object_sdfs
@@ -5,10 +5,23 @@ import copy
 from trimesh.proximity import closest_point
 from trimesh.constants import tol
 import trimesh.transformations as ttf
-import mesh_to_sdf
-import skimage.measure as measure
+
+from helper import metrics
+from scene_utils.MeshSDF import MeshSDF
+
+# settings of generate_sdf_with_library: depth scans of the scan method (count and
+# pixels per side, sample_point_count is not used by scans) and band and sweeps of the
+# cpu method, see benchmarks/tsdf_quality.py for their accuracy and cost
+QUALITY_PRESETS = {
+    'draft': dict(scan_count=6, scan_resolution=300, band=2, sweeps=1),
+    'default': dict(scan_count=15, scan_resolution=600, band=2, sweeps=2),
+    'high': dict(scan_count=40, scan_resolution=800, band=3, sweeps=3),
+    'reference': dict(scan_count=100, scan_resolution=600, band=4, sweeps=4),
+}
 
 def tsdf_to_mesh(tsdf):
+    import skimage.measure as measure
+
     vertices, faces, vertex_normals, _ = \
         measure.marching_cubes_lewiner(tsdf, level=0, gradient_direction='descent')
     mesh = trimesh.Trimesh(
@@ -39,6 +52,8 @@ class TSDFScene:
         :param check_result:
         :return:
         """
+        import mesh_to_sdf
+
         # center the mesh
         if scene_center is None:
             center = mesh.bounding_box.centroid
@@ -49,11 +64,13 @@ class TSDFScene:
 
         mesh = trimesh.Trimesh(vertices=vertices, faces=mesh.faces)
 
-        surface_point_cloud = mesh_to_sdf.get_surface_point_cloud(mesh, surface_point_method, 3 ** 0.5, scan_count, scan_resolution,
-                                                      sample_point_count, sign_method == 'normal')
+        with metrics.stage("scan"):
+            surface_point_cloud = mesh_to_sdf.get_surface_point_cloud(mesh, surface_point_method, 3 ** 0.5, scan_count, scan_resolution,
+                                                          sample_point_count, sign_method == 'normal')
 
-        return surface_point_cloud.get_voxels(voxel_resolution, sign_method == 'depth', normal_sample_count, pad,
-                                              check_result)
+        with metrics.stage("voxelize"):
+            return surface_point_cloud.get_voxels(voxel_resolution, sign_method == 'depth', normal_sample_count, pad,
+                                                  check_result)
 
     @classmethod
     def generate_sdf_with_library(cls,
@@ -61,11 +78,16 @@ class TSDFScene:
                                   fixed_floor=None,
                                   scene_center=None,
                                   move_pixel_rows=None,
-                                  voxel_res = 64):
+                                  voxel_res = 64,
+                                  method='scan',
+                                  quality='default'):
         """
         Generates an SDF grid from a joint mesh directly
         The original mesh is scaled by 64! (This is dependant on the voxel resolution)!
         :param scene:
+        :param method: 'scan' renders depth scans with mesh_to_sdf (needs OpenGL),
+                       'cpu' computes exact distances with MeshSDF
+        :param quality: name of the QUALITY_PRESETS entry
         :return:
         """
 
@@ -76,16 +98,25 @@ class TSDFScene:
 
         joint_mesh = joint_mesh.apply_scale(2)
 
-        sdf_grid = TSDFScene.mesh_to_voxels_no_rescaling(joint_mesh, voxel_resolution=voxel_res, surface_point_method='scan',
-                                                    sign_method='depth',
-                                                    scan_count=15, scan_resolution=600, sample_point_count=10000,
-                                                    pad=False, check_result=False, scene_center=scene_center)
-
-        sdf_grid = sdf_grid / 2
-        if fixed_floor is not None:
-            sdf_grid = TSDFScene.move_to_fixed_floor(sdf_grid, fixed_floor)
-        elif move_pixel_rows is not None:
-            sdf_grid = TSDFScene.move_by_fixed_amount(sdf_grid, move_pixel_rows)
+        preset = QUALITY_PRESETS[quality]
+        if method == 'cpu':
+            sdf_grid = MeshSDF.mesh_to_voxels(joint_mesh, voxel_resolution=voxel_res, scene_center=scene_center,
+                                              band=preset['band'], sweeps=preset['sweeps'])
+        else:
+            sdf_grid = TSDFScene.mesh_to_voxels_no_rescaling(joint_mesh, voxel_resolution=voxel_res, surface_point_method='scan',
+                                                        sign_method='depth',
+                                                        scan_count=preset['scan_count'],
+                                                        scan_resolution=preset['scan_resolution'],
+                                                        sample_point_count=10000,
+                                                        pad=False, check_result=False, scene_center=scene_center)
+
+        sdf_grid = np.asarray(sdf_grid, dtype=np.float32)
+        sdf_grid /= 2
+        with metrics.stage("floor_shift"):
+            if fixed_floor is not None:
+                sdf_grid = TSDFScene.move_to_fixed_floor(sdf_grid, fixed_floor)
+            elif move_pixel_rows is not None:
+                sdf_grid = TSDFScene.move_by_fixed_amount(sdf_grid, move_pixel_rows)
         return sdf_grid
 
 
@@ -97,15 +128,16 @@ class TSDFScene:
         """
 
         remove_rows = amount
-        new_sdf = np.ones(sdf_grid.shape) * 10
+        # same dtype as the grid, the rows moved in are filled with the largest remaining value
+        new_sdf = np.empty_like(sdf_grid)
         if remove_rows > 0:
             max_val = sdf_grid[:, :, remove_rows:].max()
             new_sdf[:, :, 0:sdf_grid.shape[2] - remove_rows] = sdf_grid[:, :, remove_rows:]
-            new_sdf[new_sdf == 10] = max_val
+            new_sdf[:, :, sdf_grid.shape[2] - remove_rows:] = max_val
         elif remove_rows < 0:
             max_val = sdf_grid[:, :, 0:sdf_grid.shape[2] - abs(remove_rows)].max()
             new_sdf[:, :, abs(remove_rows):] = sdf_grid[:, :, 0:sdf_grid.shape[2] - abs(remove_rows)]
-            new_sdf[new_sdf == 10] = max_val
+            new_sdf[:, :, :abs(remove_rows)] = max_val
 
             # assert scene doesn't grow out of bounds
             last_row = new_sdf[:, :, -1]
@@ -118,85 +150,80 @@ class TSDFScene:
 
 
     @classmethod
-    def move_to_fixed_floor(cls, sdf_grid, floor_location=20):
+    def fixed_floor_shift(cls, sdf_grid, floor_location=20):
         """
-        Moves the scene to a fixed floor location accuracte to 1 voxel.
-        It does so by moving the first negative voxel value (the first inside value) to z location floor_location + 1
-        :param sdf_grid:
-        :return:
+        Number of rows move_to_fixed_floor moves the grid down by, so that the
+        first row with a negative (inside) value ends up at floor_location
         """
-
-        current_floor = 0
-        for row in range(sdf_grid.shape[2]):
-            _2d_p = sdf_grid[:,:,row]
-            if (_2d_p < 0).any():
-                current_floor = row
-                break
+        inside_rows = np.flatnonzero((sdf_grid < 0).any(axis=(0, 1)))
+        current_floor = inside_rows[0] if len(inside_rows) else 0
 
         if current_floor > (sdf_grid.shape[2] / 2):
             raise ValueError("scene start above center")
 
-        remove_rows = current_floor - floor_location
+        return int(current_floor - floor_location)
 
+    @classmethod
+    def move_to_fixed_floor(cls, sdf_grid, floor_location=20):
+        """
+        Moves the scene to a fixed floor location accuracte to 1 voxel.
+        It does so by moving the first negative voxel value (the first inside value) to z location floor_location + 1
+        :param sdf_grid:
+        :return:
+        """
+        return cls.move_by_fixed_amount(sdf_grid, cls.fixed_floor_shift(sdf_grid, floor_location))
 
-        new_sdf = np.ones(sdf_grid.shape) * 10
-        if remove_rows > 0:
-            max_val = sdf_grid[:,:,remove_rows:].max()
-            new_sdf[:,:,0:sdf_grid.shape[2] - remove_rows] = sdf_grid[:,:,remove_rows:]
-            new_sdf[new_sdf == 10] = max_val
-        elif remove_rows < 0:
-            max_val = sdf_grid[:,:,0:sdf_grid.shape[2]-abs(remove_rows)].max()
-            new_sdf[:,:,abs(remove_rows):] = sdf_grid[:,:,0:sdf_grid.shape[2]-abs(remove_rows)]
-            new_sdf[new_sdf == 10] = max_val
-
-            #assert scene doesn't grow out of bounds
-            last_row = new_sdf[:,:,-1]
-            if (last_row < 0).any():
-                raise ValueError("Scene out of bounds!!!")
-        else:
-            new_sdf = sdf_grid
 
-        return new_sdf
 
+def _object_tsdf(mesh, scene_center, method, quality):
+    # generate_sdf_with_library scales the mesh by 2, so does the center
+    return TSDFScene.generate_sdf_with_library(mesh,
+                                               fixed_floor=None,
+                                               scene_center=scene_center * 2,
+                                               move_pixel_rows=None,
+                                               method=method,
+                                               quality=quality)
 
 
-def create_tsdf_per_object(scene_dict):
+def create_tsdfs_per_object(scene_dict, fixed_floor=15, method='scan', pool=None, quality='default'):
     """
-    Generates a TSDF volume for every object in the scene
+    Generates the scene TSDF and a TSDF volume for every object in one pass
+
+    Every object is computed once (with generate_sdf_with_library's `method` and `quality`) on the grid of the whole scene, the scene TSDF
+    is the union (minimum) of the object volumes and all volumes are moved by
+    the rows that put the lowest inside voxel of the scene at `fixed_floor`.
+    With a multiprocessing `pool`, the objects are computed in its processes
+    (their stage metrics are not recorded).
+    :return: scene_tsdf, per_object_tsdfs
     """
 
-    scene = scene_dict['scene']
-
-    joint_mesh = scene.dump(concatenate=True)
-    scene_center = joint_mesh.bounding_box.centroid
-
-    per_object_tsdfs = []
+    # world space meshes, the meshes of the scene dict are left untouched
+    meshes = [mesh.copy().apply_transform(transform) for mesh, transform in
+              zip(scene_dict['meshes'].values(), scene_dict['transforms'].values())]
 
-    lowest_z = 64 # number which is always larger than possible position
-    for mesh_t, scale_t, transform_t in zip(scene_dict['meshes'].items(), scene_dict['mesh_scales'].items(),
-                                            scene_dict['transforms'].items()):
-        ind_scene = trimesh.Scene()
-        key, mesh = mesh_t
-        mesh = mesh.apply_transform(transform_t[1])
+    vertices = np.concatenate([mesh.vertices for mesh in meshes])
+    scene_center = (vertices.min(axis=0) + vertices.max(axis=0)) / 2
 
-        ind_scene.add_geometry(mesh)
+    jobs = [(mesh, scene_center, method, quality) for mesh in meshes]
+    if pool is None:
+        per_object_tsdfs = [_object_tsdf(*job) for job in jobs]
+    else:
+        with metrics.stage("object_pool"):
+            # starmap keeps the order of the objects
+            per_object_tsdfs = pool.starmap(_object_tsdf, jobs, chunksize=1)
 
-        ind_tsdf = TSDFScene.generate_sdf_with_library(ind_scene,
-                                                       fixed_floor=None,
-                                                       scene_center=scene_center,
-                                                       move_pixel_rows=None)
+    scene_tsdf = np.min(per_object_tsdfs, axis=0)
 
-        ind_mesh = tsdf_to_mesh(ind_tsdf)
-        min_mesh_z = ind_mesh.vertices.min(axis=0)[2]
-        if min_mesh_z < lowest_z:
-            lowest_z = min_mesh_z
+    with metrics.stage("floor_shift"):
+        rows = TSDFScene.fixed_floor_shift(scene_tsdf, fixed_floor)
+        scene_tsdf = TSDFScene.move_by_fixed_amount(scene_tsdf, rows)
+        per_object_tsdfs = [TSDFScene.move_by_fixed_amount(ind_tsdf, rows) for ind_tsdf in per_object_tsdfs]
 
-        per_object_tsdfs.append(ind_tsdf)
+    return scene_tsdf, per_object_tsdfs
 
-    moved_per_object_tsdfs = []
-    for ind_tsdf in per_object_tsdfs:
-        moved_ind_tsdf = TSDFScene.move_by_fixed_amount(ind_tsdf, round(lowest_z - 15.0))
-        moved_per_object_tsdfs.append(moved_ind_tsdf)
-    per_object_tsdfs = moved_per_object_tsdfs
 
-    return per_object_tsdfs
\ No newline at end of file
+def create_tsdf_per_object(scene_dict):
+    """
+    Generates a TSDF volume for every object in the scene
+    """
+    return create_tsdfs_per_object(scene_dict)[1]
@@ -0,0 +1,272 @@
+"""
+Storage of the scene and per-object TSDFs of a scene folder
+
+The grids keep their names (scene_tsdf.npy, tsdf0.npy, ...) and are stored in
+one of ENCODINGS, described by a tsdf_meta.json next to them:
+
+    float32   the signed distances, optionally clipped to +-truncation
+    float16   the same in half precision (about 3 significant digits)
+    int8      the distances clipped to +-truncation and quantized to
+              round(127 * d / truncation), i.e. steps of truncation / 127;
+              negative distances stay negative, so the occupancy is exact
+
+With a truncation, the object grids can be stored cropped: tsdfN.npy then
+only holds the box of the voxels closer than the truncation (the object and its
+band), everything outside of it is +truncation. The offsets of the boxes in the
+scene grid are in the metadata, load_object_tsdf inflates them again.
+
+The occupancy (sdf < 0) of the scene and of every (full) object grid is
+stored bit-packed in occupancy.npy, one np.packbits row of 64^3 / 8 = 32 KB per
+grid, the scene first, so occupancy-only runs need not read the grids.
+
+Coarser levels of all grids (a pyramid, e.g. levels 32 and 16 of 64^3 grids)
+can be stored next to them as scene_tsdf_32.npy, tsdf0_32.npy, occupancy_32.npy,
+... A coarse voxel is the minimum of the block of fine voxels it covers, so it
+is inside exactly if one of them is (thin parts do not vanish) and its
+distance is a lower bound. Coarse voxel k covers fine voxels k * f to
+k * f + f - 1, so the levels are aligned without any offset: the first inside
+row of the fixed floor (row 15 of 64) is row 15 // f of every level. Levels
+that are not stored are downsampled from the fine grids when loaded.
+
+Grids of folders without tsdf_meta.json (older datasets) are read as stored.
+Every file is written to a temporary file first and renamed, the metadata
+first and scene_tsdf.npy last, so a folder with a scene_tsdf.npy is complete.
+"""
+import json
+import os
+
+import numpy as np
+
+ENCODINGS = ("float32", "float16", "int8")
+META_FILE = "tsdf_meta.json"
+OCCUPANCY_FILE = "occupancy.npy"
+
+
+def check_encoding(encoding, truncation=None, crop_objects=False):
+    if encoding not in ENCODINGS:
+        raise ValueError(f"unknown tsdf encoding {encoding}, expected one of {ENCODINGS}")
+    if encoding == "int8" and truncation is None:
+        raise ValueError("the int8 tsdf encoding needs a truncation distance")
+    if crop_objects and truncation is None:
+        raise ValueError("cropped object tsdfs need a truncation distance")
+
+
+def encode(grid, encoding="float32", truncation=None):
+    check_encoding(encoding, truncation)
+    grid = np.asarray(grid, dtype=np.float32)
+    if truncation is not None:
+        grid = np.clip(grid, -truncation, truncation)
+    if encoding == "int8":
+        quantized = np.round(grid * (127 / truncation)).astype(np.int8)
+        # keep the occupancy (sdf < 0) of distances that round to zero
+        quantized[(quantized == 0) & (grid < 0)] = -1
+        return quantized
+    return grid.astype(encoding, copy=False)
+
+
+def decode(array, meta):
+    """float32 grid of a stored array, `meta` as read by read_meta (None: stored as is)"""
+    if meta is None:
+        return array
+    if meta["encoding"] == "int8":
+        return array.astype(np.float32) * np.float32(meta["truncation"] / 127)
+    return array.astype(np.float32, copy=False)
+
+
+def check_levels(shape, levels):
+    for resolution in levels:
+        if resolution <= 0 or resolution >= shape[0] or any(size % resolution for size in shape):
+            raise ValueError(f"pyramid level {resolution} does not divide the grid of {shape[0]}")
+
+
+def downsample(grid, factor):
+    """Minimum of every block of factor^3 voxels"""
+    grid = np.asarray(grid)
+    blocks = grid.reshape(tuple(n for size in grid.shape for n in (size // factor, factor)))
+    return blocks.min(axis=tuple(range(1, 2 * grid.ndim, 2)))
+
+
+def level_name(name, resolution=None):
+    """File or metadata name of a pyramid level: tsdf0.npy -> tsdf0_32.npy, shape -> shape_32"""
+    if resolution is None:
+        return name
+    stem, extension = os.path.splitext(name)
+    return f"{stem}_{resolution}{extension}"
+
+
+def _stored_level(meta, resolution):
+    """The stored level of `resolution`, None for the fine grids"""
+    return resolution if meta is not None and resolution in meta.get("levels", []) else None
+
+
+def _to_resolution(grid, resolution):
+    """The grid downsampled to `resolution` unless it has it already"""
+    if resolution is None or grid.shape[0] == resolution:
+        return grid
+    check_levels(grid.shape, [resolution])
+    return downsample(grid, grid.shape[0] // resolution)
+
+
+def crop_box(grid, truncation):
+    """Offset and stop (exclusive) of the box of the voxels below the truncation, empty for an empty grid"""
+    inside = grid < truncation
+    offset, stop = [], []
+    for axis in range(grid.ndim):
+        occupied = np.flatnonzero(inside.any(axis=tuple(a for a in range(grid.ndim) if a != axis)))
+        offset.append(int(occupied[0]) if len(occupied) else 0)
+        stop.append(int(occupied[-1]) + 1 if len(occupied) else 0)
+    return offset, stop
+
+
+def inflate(crop, offset, shape, fill):
+    """Full grid of a crop at `offset`, `fill` everywhere else"""
+    grid = np.full(shape, fill, dtype=crop.dtype)
+    grid[tuple(slice(o, o + n) for o, n in zip(offset, crop.shape))] = crop
+    return grid
+
+
+def crop_fill(meta):
+    """Decoded value outside of the object crops: the stored value of the truncation"""
+    if meta is None or meta.get("truncation") is None:
+        return 0.0
+    return float(decode(encode([meta["truncation"]], meta["encoding"], meta["truncation"]), meta)[0])
+
+
+def read_meta(scene_dir):
+    meta_file = os.path.join(scene_dir, META_FILE)
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file) as fp:
+        return json.load(fp)
+
+
+def load_tsdf(filename, meta=None):
+    """Decoded grid of a scene_tsdf.npy or tsdfN.npy file, reads the metadata of its folder unless given"""
+    if meta is None:
+        meta = read_meta(os.path.dirname(filename))
+    return decode(np.load(filename), meta)
+
+
+def load_scene_tsdf(scene_dir, meta=None, resolution=None):
+    """Decoded scene grid, of the pyramid level `resolution` if given"""
+    if meta is None:
+        meta = read_meta(scene_dir)
+    stored = _stored_level(meta, resolution)
+    return _to_resolution(load_tsdf(os.path.join(scene_dir, level_name("scene_tsdf.npy", stored)), meta), resolution)
+
+
+def load_object_tsdf(scene_dir, j, meta=None, crop=False, resolution=None):
+    """
+    Decoded grid of object j, inflated to the scene grid; with `crop` the stored
+    (possibly cropped) grid and its offset in the scene grid instead. Of the
+    pyramid level `resolution` if given
+    """
+    if meta is None:
+        meta = read_meta(scene_dir)
+    stored = _stored_level(meta, resolution)
+    if resolution is not None and stored is None and (meta is None or resolution != meta["shape"][0]):
+        # not stored, downsampled from the inflated fine grid
+        grid = _to_resolution(load_object_tsdf(scene_dir, j, meta), resolution)
+        return (grid, [0] * grid.ndim) if crop else grid
+
+    grid = load_tsdf(os.path.join(scene_dir, level_name(f"tsdf{j}.npy", stored)), meta)
+    offsets = level_name("object_offsets", stored)
+    if meta is None or offsets not in meta:
+        return (grid, [0] * grid.ndim) if crop else grid
+    offset = meta[offsets][j]
+    if crop:
+        return grid, offset
+    return inflate(grid, offset, meta[level_name("shape", stored)], crop_fill(meta))
+
+
+def pack_occupancy(grids):
+    """(len(grids), size / 8) packed bits of grid < 0"""
+    return np.packbits(np.stack([np.asarray(grid) < 0 for grid in grids]).reshape(len(grids), -1), axis=1)
+
+
+def load_occupancy(scene_dir, meta=None, resolution=None):
+    """
+    (1 + number of objects, *shape) boolean occupancy of the scene and the
+    objects (of the pyramid level `resolution` if given), None for folders
+    without the occupancy file of the level
+    """
+    if meta is None:
+        meta = read_meta(scene_dir)
+    stored = _stored_level(meta, resolution)
+    occupancy_file = os.path.join(scene_dir, level_name(OCCUPANCY_FILE, stored))
+    if meta is None or not os.path.exists(occupancy_file) \
+            or (stored is None and resolution not in (None, meta["shape"][0])):
+        return None
+    shape = tuple(meta[level_name("shape", stored)])
+    packed = np.load(occupancy_file)
+    return np.unpackbits(packed, axis=1, count=int(np.prod(shape))).view(bool).reshape((len(packed),) + shape)
+
+
+def _replace(filename, write):
+    temporary = f"{filename}.tmp{os.getpid()}"
+    try:
+        write(temporary)
+        os.replace(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def _save_array(filename, array):
+    def write(temporary):
+        with open(temporary, "wb") as fp:
+            np.save(fp, array)
+
+    _replace(filename, write)
+
+
+def _encode_level(meta, resolution, scene_tsdf, object_tsdfs, encoding, truncation, crop_objects):
+    """Stored arrays of a level by file name, the scene grid last; adds the level to `meta`"""
+    meta[level_name("shape", resolution)] = list(np.shape(scene_tsdf))
+    scene_tsdf = encode(scene_tsdf, encoding, truncation)
+    encoded = [encode(tsdf, encoding, truncation) for tsdf in object_tsdfs]
+    # of the stored values, so that it matches the decoded grids (float16 rounds tiny distances to zero)
+    arrays = {level_name(OCCUPANCY_FILE, resolution): pack_occupancy([scene_tsdf] + encoded)}
+    if crop_objects:
+        boxes = [crop_box(tsdf, truncation) for tsdf in object_tsdfs]
+        encoded = [tsdf[tuple(slice(o, s) for o, s in zip(offset, stop))]
+                   for tsdf, (offset, stop) in zip(encoded, boxes)]
+        meta[level_name("object_offsets", resolution)] = [offset for offset, _ in boxes]
+    for j, tsdf in enumerate(encoded):
+        arrays[level_name(f"tsdf{j}.npy", resolution)] = tsdf
+    arrays[level_name("scene_tsdf.npy", resolution)] = scene_tsdf
+    return arrays
+
+
+def save_scene(scene_dir, scene_tsdf, object_tsdfs=None, encoding="float32", truncation=None, crop_objects=False,
+               levels=()):
+    """
+    Writes the scene grid, the object grids (if any, cropped with `crop_objects`),
+    the pyramid `levels` (resolutions, e.g. (32, 16)) of both and their metadata
+    """
+    check_encoding(encoding, truncation, crop_objects)
+    check_levels(np.shape(scene_tsdf), levels)
+    scene_file = os.path.join(scene_dir, "scene_tsdf.npy")
+    # an old scene grid would mark the folder complete while the others are rewritten
+    if os.path.exists(scene_file):
+        os.remove(scene_file)
+
+    meta = {"encoding": encoding, "truncation": truncation, "levels": list(levels)}
+    object_tsdfs = list(object_tsdfs or [])
+    arrays = {}
+    for resolution in levels:
+        factor = np.shape(scene_tsdf)[0] // resolution
+        arrays.update(_encode_level(meta, resolution, downsample(scene_tsdf, factor),
+                                    [downsample(tsdf, factor) for tsdf in object_tsdfs],
+                                    encoding, truncation, crop_objects))
+    arrays.update(_encode_level(meta, None, scene_tsdf, object_tsdfs, encoding, truncation, crop_objects))
+
+    def write_meta(temporary):
+        with open(temporary, "w") as fp:
+            json.dump(meta, fp)
+
+    _replace(os.path.join(scene_dir, META_FILE), write_meta)
+
+    # the fine scene grid last
+    for filename, array in arrays.items():
+        _save_array(os.path.join(scene_dir, filename), array)
@@ -0,0 +1,240 @@
+"""
+Endless stream of generated piles: background processes run the scene
+generation of generate_dataset.py (one rendered view, only its poses are
+used) and the TSDF computation, and the iterable dataset yields the samples
+in the format of VoxelGridLoader through a bounded queue
+
+    dataset = StreamingPileDataset(model_dir, max_n_objects=8, n_workers=4, sdf_method="atlas")
+    batches = DataLoader(dataset, batch_size=8, num_workers=0)
+
+The generation runs in processes of its own, so use the DataLoader without
+workers (their processes cannot start processes). With `cache_size`, the
+samples are also written to `cache_dir` (the `cache_size` most recent ones)
+and every sample is yielded up to `reuse` times: whenever no fresh sample is
+ready, a cached one is yielded instead of waiting. stats() (printed every
+`report_every` samples) shows whether the generation keeps up: scenes
+generated per second, fresh and reused samples and the time spent waiting.
+"""
+import collections
+import multiprocessing
+import os
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import path
+import torch
+
+# share the scene generation and the helper modules of the scene generator
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RandomSceneGenerator'))
+
+from helper import provenance, threads
+from data_loader import PileLoader
+from materialize import scene_tsdfs
+from scene_utils import tsdf_storage
+from scene_utils.SDFAtlas import SDFAtlas
+
+STREAM_METHODS = ("analytic", "atlas", "cpu", "scan")
+# interval of the checks whether the workers are still alive while waiting for a sample
+POLL_SECONDS = 1.0
+
+
+def _generate_scenes(slot, n_workers, samples, settings):
+    """Generates the scenes slot, slot + n_workers, ... and puts (index, seconds, grids or None) into `samples`"""
+    # imported in the worker, importing it sets the thread limits from the command line
+    import pybullet
+    import generate_dataset
+    threads.WorkerInit(n_workers, settings["threads_per_worker"])(slot)
+
+    data_loader = PileLoader(settings["work_dir"], settings["model_dir"])
+    sdf_atlas = SDFAtlas(settings["atlas_dir"]) if settings["sdf_method"] == "atlas" else None
+    generator_parameters = dict(generate_dataset.GENERATOR_PARAMETERS, n_views=1)
+
+    index = slot
+    while True:
+        scene_dir = path.Path(settings["work_dir"]) / f"{index:08d}"
+        start = time.perf_counter()
+        grids = None
+        try:
+            generate_dataset.create_scene(scene_dir, settings["model_dir"], index,
+                                          seed=provenance.scene_seed(settings["seed"], index),
+                                          connection_method=pybullet.DIRECT,
+                                          min_objects=settings["min_objects"],
+                                          max_objects=settings["max_objects"],
+                                          generator_parameters=generator_parameters)
+            # the layout create_dataset.organise_folders makes
+            (scene_dir / "pybullet_scene_info").mkdir_p()
+            shutil.move(scene_dir / "00000000.npz", scene_dir / "pybullet_scene_info" / "00000000.npz")
+            scene_tsdf, object_tsdfs = scene_tsdfs(data_loader, scene_dir, settings["sdf_method"], sdf_atlas,
+                                                   settings["quality"])
+            grids = (np.asarray(scene_tsdf, dtype=np.float32), [np.asarray(tsdf, dtype=np.float32)
+                                                                  for tsdf in object_tsdfs])
+        except Exception as e:
+            print(f"streaming: scene {index} failed: {e}")
+        finally:
+            shutil.rmtree(scene_dir, ignore_errors=True)
+        samples.put((index, time.perf_counter() - start, grids))
+        index += n_workers
+
+
+class StreamingPileDataset(torch.utils.data.IterableDataset):
+
+    def __init__(self, model_dir, max_n_objects=8, min_objects=4, max_objects=8, n_workers=1, queue_size=8,
+                 sdf_method="analytic", atlas_dir=None, quality="default", seed=0, threads_per_worker=None,
+                 work_dir=None, cache_dir=None, cache_size=0, reuse=1, encoding="float32", truncation=None,
+                 report_every=0):
+        """
+        `sdf_method` and `quality` as in create_dataset.py, `encoding` and
+        `truncation` of the cached samples as well
+        """
+        if sdf_method not in STREAM_METHODS:
+            raise ValueError(f"unknown sdf method {sdf_method}, expected one of {STREAM_METHODS}")
+        tsdf_storage.check_encoding(encoding, truncation)
+        self.settings = dict(model_dir=model_dir, min_objects=min_objects, max_objects=max_objects,
+                             sdf_method=sdf_method, quality=quality, seed=seed,
+                             atlas_dir=atlas_dir or os.path.join(model_dir, 'sdf_atlas'),
+                             threads_per_worker=threads_per_worker)
+        self.max_n_objects = max_n_objects
+        self.n_workers = n_workers
+        self.queue_size = queue_size
+        self.work_dir = work_dir
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.reuse = reuse
+        self.encoding = encoding
+        self.truncation = truncation
+        self.report_every = report_every
+        self.random = random.Random(seed)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._stats = {"generated": 0, "failed": 0, "generation_seconds": 0.0, "fresh": 0, "reused": 0,
+                       "stall_seconds": 0.0, "wall_seconds": 0.0}
+
+    def stats(self):
+        """
+        generated / failed scenes, generation_seconds (summed over the workers),
+        fresh and reused samples yielded and the time spent waiting for fresh ones
+        """
+        stats = dict(self._stats)
+        wall = stats["wall_seconds"]
+        stats["scenes_per_second"] = stats["generated"] / wall if wall else 0.0
+        stats["samples_per_second"] = (stats["fresh"] + stats["reused"]) / wall if wall else 0.0
+        stats["stall_fraction"] = stats["stall_seconds"] / wall if wall else 0.0
+        return stats
+
+    def sample(self, scene_tsdf, object_tsdfs):
+        """Sample of VoxelGridLoader from the grids"""
+        scene = torch.from_numpy(scene_tsdf).unsqueeze(0)
+        sample = {"scene": scene, "scene_occ": (scene < 0).to(scene.dtype)}
+        if len(object_tsdfs) > 0:
+            objects = torch.zeros((max(self.max_n_objects, len(object_tsdfs)),) + scene_tsdf.shape,
+                                  dtype=scene.dtype)
+            for j, tsdf in enumerate(object_tsdfs):
+                objects[j] = torch.from_numpy(tsdf)
+            sample.update({"concatenated_objects": objects,
+                           "concatenated_objects_occ": (objects < 0).to(objects.dtype),
+                           "nbr_of_objects": len(object_tsdfs)})
+        return sample
+
+    def _cache(self, cache, cache_dir, index, grids):
+        scene_dir = os.path.join(cache_dir, f"{index:08d}")
+        os.makedirs(scene_dir, exist_ok=True)
+        tsdf_storage.save_scene(scene_dir, grids[0], grids[1], encoding=self.encoding, truncation=self.truncation)
+        cache[index] = [self.reuse - 1, len(grids[1])]
+        while len(cache) > self.cache_size:
+            evicted, _ = cache.popitem(last=False)
+            shutil.rmtree(os.path.join(cache_dir, f"{evicted:08d}"), ignore_errors=True)
+
+    def _from_cache(self, cache, cache_dir):
+        index = self.random.choice(list(cache))
+        scene_dir = os.path.join(cache_dir, f"{index:08d}")
+        meta = tsdf_storage.read_meta(scene_dir)
+        scene_tsdf = tsdf_storage.load_tsdf(os.path.join(scene_dir, "scene_tsdf.npy"), meta)
+        object_tsdfs = [tsdf_storage.load_object_tsdf(scene_dir, j, meta) for j in range(cache[index][1])]
+        cache[index][0] -= 1
+        if cache[index][0] <= 0:
+            del cache[index]
+            shutil.rmtree(scene_dir, ignore_errors=True)
+        return scene_tsdf, object_tsdfs
+
+    @classmethod
+    def _wait_for_sample(cls, samples, workers):
+        """The next generated scene, raises once all workers have exited without one"""
+        while True:
+            try:
+                return samples.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    raise RuntimeError("streaming: all generation workers exited, exit codes "
+                                       f"{[worker.exitcode for worker in workers]}")
+
+    def __iter__(self):
+        if torch.utils.data.get_worker_info() is not None:
+            raise RuntimeError("StreamingPileDataset generates in processes of its own, use num_workers=0")
+
+        work_dir = tempfile.mkdtemp(prefix="streaming_", dir=self.work_dir)
+        cache_dir = self.cache_dir or os.path.join(work_dir, "cache")
+        use_cache = self.cache_size > 0 and self.reuse > 1
+        if use_cache:
+            os.makedirs(cache_dir, exist_ok=True)
+        # cached samples by index: how often they may still be yielded and their number of objects, oldest first
+        cache = collections.OrderedDict()
+
+        context = multiprocessing.get_context("fork")
+        samples = context.Queue(maxsize=self.queue_size)
+        settings = dict(self.settings, work_dir=work_dir)
+        workers = [context.Process(target=_generate_scenes, args=(slot, self.n_workers, samples, settings),
+                                   daemon=True)
+                   for slot in range(self.n_workers)]
+        for worker in workers:
+            worker.start()
+
+        start = time.perf_counter()
+        n_yielded = 0
+        try:
+            while True:
+                if cache:
+                    try:
+                        fresh = samples.get(block=False)
+                    except queue.Empty:
+                        fresh = None
+                else:
+                    wait = time.perf_counter()
+                    fresh = self._wait_for_sample(samples, workers)
+                    self._stats["stall_seconds"] += time.perf_counter() - wait
+                if fresh is None:
+                    # nothing fresh is ready, reuse a cached sample
+                    grids = self._from_cache(cache, cache_dir)
+                    self._stats["reused"] += 1
+                else:
+                    index, seconds, grids = fresh
+                    self._stats["generation_seconds"] += seconds
+                    if grids is None:
+                        self._stats["failed"] += 1
+                        self._stats["wall_seconds"] = time.perf_counter() - start
+                        continue
+                    self._stats["generated"] += 1
+                    self._stats["fresh"] += 1
+                    if use_cache:
+                        self._cache(cache, cache_dir, index, grids)
+
+                n_yielded += 1
+                self._stats["wall_seconds"] = time.perf_counter() - start
+                if self.report_every and n_yielded % self.report_every == 0:
+                    print(f"streaming: {self.stats()}")
+                yield self.sample(*grids)
+                self._stats["wall_seconds"] = time.perf_counter() - start
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+            shutil.rmtree(work_dir, ignore_errors=True)
+            if use_cache and self.cache_dir is not None:
+                for index in cache:
+                    shutil.rmtree(os.path.join(cache_dir, f"{index:08d}"), ignore_errors=True)
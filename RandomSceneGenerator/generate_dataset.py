@@ -4,17 +4,35 @@ import argparse
 import datetime
 import shutil
 import os
+
+from helper import threads
+# limit the thread pools of every process before NumPy and friends are loaded
+threads.configure_from_argv()
+
 import numpy as np
 import pybullet
-import multiprocessing
-from helper import extra, plane_type, utils
+from helper import extra, geometry, metrics, plane_type, profiling, provenance, utils
+from helper.scheduler import MemoryBudgetScheduler
 
 from model_loaders.SuperQuadricModels import SuperQuadricModels
 from model_loaders.YCBModels import YCB_Models
 
-from scene_utils.ObjectPileSceneParser import ObjectPileSceneParser
-
-def generate_data(out, model_dir, random_state, connection_method, min_objects=4, max_objects=8):
+# parameters of PlaneTypeSceneGeneration, recorded in every scene's provenance
+GENERATOR_PARAMETERS = dict(
+    extents=(0.45, 0.45, 0.3),
+    mesh_scale=((0.1, 0.05, 0.1), (0.20, 0.20, 0.20)),
+    n_trial=9,
+    trajectory="spline",
+    n_views=7,
+)
+
+
+def generate_data(out, model_dir, random_state, connection_method, min_objects=4, max_objects=8,
+                  extents=GENERATOR_PARAMETERS['extents'],
+                  mesh_scale=GENERATOR_PARAMETERS['mesh_scale'],
+                  n_trial=GENERATOR_PARAMETERS['n_trial'],
+                  trajectory=GENERATOR_PARAMETERS['trajectory'],
+                  n_views=GENERATOR_PARAMETERS['n_views']):
     out.makedirs_p()
     (out / 'models').mkdir_p()
 
@@ -25,7 +43,7 @@ def generate_data(out, model_dir, random_state, connection_method, min_objects=4
     class_weight /= class_weight.sum()
 
     generator = plane_type.PlaneTypeSceneGeneration(
-        extents=(0.45, 0.45, 0.3),
+        extents=tuple(extents),
         models=models,
         min_objects=min_objects,
         max_objects=max_objects,
@@ -33,8 +51,8 @@ def generate_data(out, model_dir, random_state, connection_method, min_objects=4
         class_weight=class_weight,
         multi_instance=True,
         connection_method=connection_method,
-        mesh_scale=((0.1,0.05,0.1),(0.20,0.20,0.20)),
-        n_trial=9,
+        mesh_scale=tuple(tuple(x) for x in mesh_scale),
+        n_trial=n_trial,
     )
     pybullet.resetDebugVisualizerCamera(
         cameraDistance=1.5,
@@ -48,10 +66,11 @@ def generate_data(out, model_dir, random_state, connection_method, min_objects=4
     class_weight /= class_weight.sum()
 
     try:
-        generator.generate()
+        with metrics.stage("generate"):
+            generator.generate()
     except ValueError:
         extra.pybullet.del_world()
-        return
+        return 0
 
 
     cad_files = {}
@@ -61,40 +80,45 @@ def generate_data(out, model_dir, random_state, connection_method, min_objects=4
             shutil.copy(data['cad_file'], dst_file)
             cad_files[ins_id] = f'models/{ins_id:08d}.obj'
 
-    Ts_cam2world = generator.random_camera_trajectory(
-        n_keypoints=5, n_points=7, distance=(1, 2), elevation=(30, 90)
-    )
-    camera = extra.trimesh.OpenGLCamera(
-        resolution=(640, 480), fovy=45
-    )
+    with metrics.stage("camera_trajectory"):
+        Ts_cam2world = generator.camera_trajectory(
+            trajectory, n_keypoints=5, n_points=n_views, distance=(1, 2), elevation=(30, 90)
+        )
+    resolution = (640, 480)
+    fov = geometry.fov_from_fovy(resolution, fovy=45)
+    K = geometry.intrinsic_matrix(resolution, fov)
 
     # save number of objects in the file
     with open(os.path.join(out/"nbr_of_objects.txt"), 'w') as fp:
         fp.write(str(len(generator.unique_ids)))
 
+    # the objects do not move while rendering
+    instance_ids = generator.unique_ids
+    cad_ids = generator.unique_ids_to_cad_ids(instance_ids)
+    class_ids = generator.unique_ids_to_class_ids(instance_ids)
+    scales = generator.unique_ids_to_scales(instance_ids)
+    Ts_cad2world = generator.unique_ids_to_poses(instance_ids)
+    cad_files = [cad_files.get(i, '') for i in instance_ids]
+
+    n_instance = len(instance_ids)
+    assert len(cad_ids) == n_instance
+    assert len(class_ids) == n_instance
+    assert len(scales) == n_instance
+
     for index, T_cam2world in enumerate(Ts_cam2world):
         rgb, depth, instance_label, class_label = generator.render(
             T_cam2world,
-            fovy=camera.fov[1],
-            height=camera.resolution[1],
-            width=camera.resolution[0],
+            fovy=fov[1],
+            height=resolution[1],
+            width=resolution[0],
         )
-        instance_ids = generator.unique_ids
-        cad_ids = generator.unique_ids_to_cad_ids(instance_ids)
-        class_ids = generator.unique_ids_to_class_ids(instance_ids)
-        scales = generator.unique_ids_to_scales(instance_ids)
-        Ts_cad2world = generator.unique_ids_to_poses(instance_ids)
         T_world2cam = np.linalg.inv(T_cam2world)
         Ts_cad2cam = T_world2cam @ Ts_cad2world
 
         # validation
-        n_instance = len(instance_ids)
         assert len(Ts_cad2cam) == n_instance
-        assert len(cad_ids) == n_instance
-        assert len(class_ids) == n_instance
-        assert len(scales) == n_instance
 
-        width, height = camera.resolution
+        width, height = resolution
         assert rgb.shape == (height, width, 3)
         assert rgb.dtype == np.uint8
         assert depth.shape == (height, width)
@@ -114,56 +138,102 @@ def generate_data(out, model_dir, random_state, connection_method, min_objects=4
             depth=depth,
             instance_label=instance_label,
             class_label=class_label,
-            intrinsic_matrix=camera.K,
+            intrinsic_matrix=K,
             T_cam2world=T_cam2world,
             Ts_cad2cam=Ts_cad2cam,
             instance_ids=instance_ids,
             class_ids=class_ids,
             cad_ids=cad_ids,
             scales=scales,
-            cad_files=[cad_files.get(i, '') for i in instance_ids],
+            cad_files=cad_files,
         )
 
         npz_file = out / f'{index:08d}.npz'
-        np.savez_compressed(npz_file, **data)
+        with metrics.stage("save"):
+            np.savez_compressed(npz_file, **data)
 
+    n_placed = len(generator.unique_ids)
     extra.pybullet.del_world()
+    return n_placed
+
+
+def create_scene(scene_dir, model_dir, index, seed, connection_method, min_objects, max_objects,
+                 generator_parameters=GENERATOR_PARAMETERS, version=None):
+    """
+    Generates the scene with global index `index` from its own seeded random state
+    and records its provenance, so that it can be regenerated on its own
+    """
+    random_state = np.random.RandomState(seed)
+    # if object number is variable, sample
+    n_objects = random_state.randint(min_objects, max_objects)
+
+    scene_dir.makedirs_p()
+    provenance.write_provenance(
+        scene_dir,
+        seed=seed,
+        index=index,
+        parameters=dict(
+            model_dir=str(model_dir),
+            min_objects=min_objects,
+            max_objects=max_objects,
+            n_objects=n_objects,
+            **generator_parameters
+        ),
+        version=version,
+    )
 
+    metrics.start_scene(index, seed=seed, n_objects=n_objects)
+    n_placed = generate_data(scene_dir,
+                             model_dir,
+                             random_state=random_state,
+                             connection_method=connection_method,
+                             min_objects=min_objects,
+                             max_objects=n_objects,
+                             **generator_parameters)
+    metrics.end_scene(n_placed=n_placed, valid=n_placed >= min_objects)
 
-def main(out_dir, model_dir, n_video, n_processes, connection_method, min_objects, max_objects):
 
-    now = datetime.datetime.utcnow()
-    timestamp = now.strftime('%Y%m%d_%H%M%S.%f')
+def main(out_dir, model_dir, n_video, n_processes, connection_method, min_objects, max_objects,
+         seed=0, shard=None, run_name=None, metrics_dir=None, profile=0, profile_dir='profiles',
+         threads_per_worker=None, pin='none', track_memory=False,
+         trajectory=GENERATOR_PARAMETERS['trajectory'], n_views=GENERATOR_PARAMETERS['n_views']):
+
+    if run_name is None:
+        now = datetime.datetime.utcnow()
+        run_name = now.strftime('%Y%m%d_%H%M%S.%f')
 
     root_dir = utils.get_data_path(
-        out_dir + "/" + timestamp
+        out_dir + "/" + run_name
     )
-    if not os.path.exists(root_dir):
-       os.makedirs(root_dir)
-
-       # save max number of objects as text
-       with open(os.path.join(root_dir, "max_n_objects.txt"), 'w') as fp:
-           fp.write(str(max_objects))
-
-    def create(index,connection_method, min_objects, max_objects):
-        scene_dir = root_dir / f'{index:08d}'
-        random_state = np.random.RandomState(index)
-
-        generate_data(scene_dir,
-                      model_dir,
-                      random_state=random_state,
-                      connection_method=connection_method,
-                      min_objects=min_objects,
-                      max_objects=max_objects)
-
-    for index in range(0, n_video//n_processes):
-        start = index * n_processes
-        # if object number is variable, sample
-        n_objects = np.random.randint(min_objects, max_objects)
-        processes = [multiprocessing.Process(target=create, args=(i, connection_method, min_objects, n_objects)) for i in
-                     range(start, start + n_processes)]
-        [t.start() for t in processes]
-        [t.join() for t in processes]
+    # shards of the same run may create the directory concurrently
+    root_dir.makedirs_p()
+
+    # save max number of objects as text
+    with open(os.path.join(root_dir, "max_n_objects.txt"), 'w') as fp:
+        fp.write(str(max_objects))
+
+    shard_index, n_shards = provenance.parse_shard(shard)
+    indices = provenance.shard_indices(n_video, shard_index, n_shards)
+    version = provenance.code_version()
+    generator_parameters = dict(GENERATOR_PARAMETERS, trajectory=trajectory, n_views=n_views)
+
+    def create(index):
+        if metrics_dir is not None:
+            metrics.enable(metrics_dir, "generation", memory=track_memory)
+        with profiling.profile_scene(index, profile, profile_dir, "generation"):
+            create_scene(root_dir / f'{index:08d}',
+                         model_dir,
+                         index=index,
+                         seed=provenance.scene_seed(seed, index),
+                         connection_method=connection_method,
+                         min_objects=min_objects,
+                         max_objects=max_objects,
+                         generator_parameters=generator_parameters,
+                         version=version)
+
+    scheduler = MemoryBudgetScheduler(max_workers=n_processes,
+                                      worker_init=threads.WorkerInit(n_processes, threads_per_worker, pin))
+    scheduler.run(create, [((i,), 0) for i in indices])
 
 
 
@@ -182,8 +252,25 @@ if __name__ == '__main__':
     parser.add_argument('--max_objects', type=int, help='maximum number of objects in the scene', default=8)
     parser.add_argument('--gui', help='gui? True')
     parser.add_argument('--n_processes', type=int, help='multiprocessing: number of processes', default=1)
+    parser.add_argument('--seed', type=int, help='base seed of the dataset, scene seeds are derived from it', default=0)
+    parser.add_argument('--shard', help='only generate shard i of N of the dataset, given as i/N')
+    parser.add_argument('--run_name', help='name of the dataset folder (default: timestamp), '
+                                           'must be shared by all shards of a dataset')
+    parser.add_argument('--metrics_dir', help='write per-scene stage timings and counters into this folder')
+    parser.add_argument('--trajectory', choices=geometry.trajectory.FAMILIES,
+                        help='camera trajectory: random spline, orbit or even hemisphere coverage',
+                        default=GENERATOR_PARAMETERS['trajectory'])
+    parser.add_argument('--n_views', type=int, help='number of rendered views per scene',
+                        default=GENERATOR_PARAMETERS['n_views'])
+    parser.add_argument('--track_memory', action='store_true',
+                        help='add per-stage peak rss and traced allocations to the metrics (needs --metrics_dir)')
+    parser.add_argument('--profile', type=float, help='fraction of the scenes to run under cProfile', default=0)
+    parser.add_argument('--profile_dir', help='folder of the per-worker profiles', default='profiles')
+    threads.add_arguments(parser)
 
     args = parser.parse_args()
+    if args.track_memory and args.metrics_dir is None:
+        parser.error("--track_memory needs --metrics_dir")
 
     if args.gui == "True":
         connection_method = pybullet.GUI
@@ -192,4 +279,8 @@ if __name__ == '__main__':
 
     print(f"Generating {args.n_scenes} scenes at: {args.out_dir} \nUsing models from {args.model_dir} \n")
 
-    main(args.out_dir, args.model_dir, args.n_scenes, args.n_processes, connection_method, args.min_objects, args.max_objects)
\ No newline at end of file
+    main(args.out_dir, args.model_dir, args.n_scenes, args.n_processes, connection_method, args.min_objects,
+         args.max_objects, seed=args.seed, shard=args.shard, run_name=args.run_name,
+         metrics_dir=args.metrics_dir, profile=args.profile, profile_dir=args.profile_dir,
+         threads_per_worker=args.threads_per_worker, pin=args.pin, track_memory=args.track_memory,
+         trajectory=args.trajectory, n_views=args.n_views)
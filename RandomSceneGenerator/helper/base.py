@@ -1,10 +1,7 @@
-import frozendict
-import imgviz
 import numpy as np
 import termcolor
-import trimesh
 
-from helper import extra, get_collision_file, geometry
+from helper import extra, get_collision_file, geometry, metrics
 
 class SceneGenerationBase:
     def __init__(
@@ -38,6 +35,9 @@ class SceneGenerationBase:
 
         self._objects = {}
         self._aabb = (None, None)
+        # bumped whenever bodies may move, invalidates the cached poses
+        self._world_version = 0
+        self._poses_cache = None
         self._scene = None
 
         # launch simulator
@@ -71,25 +71,30 @@ class SceneGenerationBase:
                 pose = pybullet.getBasePositionAndOrientation(unique_id)
                 poses[unique_id] = pose
 
-        for _ in range(nstep):
-            for unique_id, pose in poses.items():
-                pybullet.resetBasePositionAndOrientation(unique_id, *pose)
-            pybullet.stepSimulation()
+        self._world_version += 1
+        with metrics.stage("simulate"):
+            for _ in range(nstep):
+                for unique_id, pose in poses.items():
+                    pybullet.resetBasePositionAndOrientation(unique_id, *pose)
+                pybullet.stepSimulation()
+        metrics.count("simulate_steps", nstep)
 
     def _is_colliding(self, unique_id):
         import pybullet
 
         # check collision
         is_colliding = False
-        for other_unique_id in extra.pybullet.unique_ids:
-            if other_unique_id == unique_id:
-                continue
-            points = pybullet.getClosestPoints(
-                other_unique_id, unique_id, distance=0
-            )
-            distances = [pt[8] for pt in points]
-            if any(d < 0 for d in distances):
-                is_colliding = True
+        with metrics.stage("collision_query"):
+            for other_unique_id in extra.pybullet.unique_ids:
+                if other_unique_id == unique_id:
+                    continue
+                points = pybullet.getClosestPoints(
+                    other_unique_id, unique_id, distance=0
+                )
+                metrics.count("closest_points_queries")
+                distances = [pt[8] for pt in points]
+                if any(d < 0 for d in distances):
+                    is_colliding = True
         return is_colliding
 
     def _spawn_object(self, class_id):
@@ -101,38 +106,42 @@ class SceneGenerationBase:
         cad_file = self._models.get_cad_file_from_id(cad_id=cad_id)
 
         if self._mesh_scale is not None:
-            mesh_scale = np.random.uniform(
+            mesh_scale = self._random_state.uniform(
                 self._mesh_scale[0], self._mesh_scale[1]
             )
         else:
             mesh_scale = None
 
+        self._world_version += 1
         unique_id = extra.pybullet.add_model(
             visual_file=cad_file,
             collision_file=get_collision_file.get_collision_file(cad_file),
             mesh_scale=mesh_scale,
         )
         for _ in range(self._n_trial):
-            position = self._random_state.uniform(*self._aabb)
-            orientation = self._random_state.uniform(-1, 1, (4,))
-            pybullet.resetBasePositionAndOrientation(
-                unique_id, position, orientation
-            )
+            metrics.count("spawn_trials")
+            with metrics.stage("spawn_trial"):
+                position = self._random_state.uniform(*self._aabb)
+                orientation = self._random_state.uniform(-1, 1, (4,))
+                pybullet.resetBasePositionAndOrientation(
+                    unique_id, position, orientation
+                )
 
-            if self._is_colliding(unique_id=unique_id):
-                continue
+                if self._is_colliding(unique_id=unique_id):
+                    continue
 
-            self._simulate(nstep=1000, fix=self._objects.keys())
+                self._simulate(nstep=1000, fix=self._objects.keys())
 
-            if not self._is_contained(unique_id=unique_id):
-                continue
+                if not self._is_contained(unique_id=unique_id):
+                    continue
 
-            self._objects[unique_id] = dict(
-                class_id=class_id, cad_id=cad_id, mesh_scale=mesh_scale,
-            )
+                self._objects[unique_id] = dict(
+                    class_id=class_id, cad_id=cad_id, mesh_scale=mesh_scale,
+                )
 
             break
         else:
+            metrics.count("spawn_failures")
             pybullet.removeBody(unique_id)
 
     def generate(self):
@@ -186,21 +195,25 @@ class SceneGenerationBase:
         )
 
     def unique_id_to_pose(self, unique_id):
-        import pybullet
-
-        pos, ori = pybullet.getBasePositionAndOrientation(unique_id)
-        R_cad2world = pybullet.getMatrixFromQuaternion(ori)
-        R_cad2world = np.asarray(R_cad2world, dtype=float).reshape(3, 3)
-        t_cad2world = np.asarray(pos, dtype=float)
-        T_cad2world = geometry.compose_transform(
-            R=R_cad2world, t=t_cad2world
-        )
-        return T_cad2world
+        unique_ids = self.unique_ids
+        if unique_id in unique_ids:
+            # served from the poses of all objects
+            return self.unique_ids_to_poses(unique_ids)[unique_ids.index(unique_id)]
+        return self.unique_ids_to_poses([unique_id])[0]
 
     def unique_ids_to_poses(self, unique_ids):
-        return np.array(
-            [self.unique_id_to_pose(i) for i in unique_ids], dtype=float,
-        )
+        """(N, 4, 4) cad to world transformations, cached until the world changes"""
+        import pybullet
+
+        key = (self._world_version, tuple(unique_ids))
+        if self._poses_cache is None or self._poses_cache[0] != key:
+            poses = np.zeros((len(unique_ids), 7), dtype=float)
+            for i, unique_id in enumerate(unique_ids):
+                pos, ori = pybullet.getBasePositionAndOrientation(unique_id)
+                poses[i, :3] = pos
+                poses[i, 3:] = ori
+            self._poses_cache = key, geometry.transform_from_pose(poses)
+        return self._poses_cache[1].copy()
 
     def unique_id_to_scale(self, unique_id):
         if unique_id in self._objects:
@@ -214,7 +227,9 @@ class SceneGenerationBase:
 
     @property
     def scene(self):
+        import frozendict
         import pyrender
+        import trimesh
 
         if self._scene is not None:
             return self._scene
@@ -243,6 +258,7 @@ class SceneGenerationBase:
         raise NotImplementedError
 
         import pyrender
+        import trimesh
 
         scene = self.scene
         node_camera = scene.add(
@@ -283,11 +299,14 @@ class SceneGenerationBase:
         return rgb, depth, ins, cls
 
     def render(self, *args, **kwargs):
-        rgb, depth, ins, cls = self._render_pybullet(*args, **kwargs)
+        with metrics.stage("render"):
+            rgb, depth, ins, cls = self._render_pybullet(*args, **kwargs)
 
         return rgb, depth, ins, cls
 
     def debug_render(self, T_camera2world):
+        import imgviz
+
         class_names = self._models.class_names
 
         height, width = 480, 640
@@ -384,10 +403,47 @@ class SceneGenerationBase:
             eyes, n_points=n_points
         )
 
-        Ts_cam2world = np.zeros((n_points, 4, 4), dtype=float)
-        for i in range(n_points):
-            Ts_cam2world[i] = geometry.look_at(eyes[i], targets[i])
-        return Ts_cam2world
+        return geometry.trajectory.poses(eyes, targets)
+
+    def orbit_camera_trajectory(
+        self, n_points=64, distance=(1, 1), elevation=(45, 90)
+    ):
+        """Circle around the center of the objects at a random distance and elevation"""
+        aabb_min, aabb_max = self.get_aabb()
+        center = (np.asarray(aabb_min) + np.asarray(aabb_max)) / 2
+
+        distance = self._random_state.uniform(distance[0], distance[1])
+        elevation = self._random_state.uniform(elevation[0], elevation[1])
+        azimuth = self._random_state.uniform(0, 360)
+        eyes = geometry.trajectory.orbit(
+            center, distance, elevation, n_points, azimuth_start=azimuth
+        )
+        return geometry.trajectory.poses(eyes, center)
+
+    def hemisphere_camera_trajectory(
+        self, n_points=64, distance=(1, 1), elevation=(45, 90)
+    ):
+        """Views evenly covering the band of elevations around the center of the objects"""
+        aabb_min, aabb_max = self.get_aabb()
+        center = (np.asarray(aabb_min) + np.asarray(aabb_max)) / 2
+
+        distance = self._random_state.uniform(distance[0], distance[1])
+        azimuth = self._random_state.uniform(0, 360)
+        eyes = geometry.trajectory.hemisphere(
+            center, distance, n_points, elevation=elevation, azimuth_start=azimuth
+        )
+        return geometry.trajectory.poses(eyes, center)
+
+    def camera_trajectory(self, family="spline", **kwargs):
+        """(N, 4, 4) camera to world transformations of a trajectory family"""
+        if family == "spline":
+            return self.random_camera_trajectory(**kwargs)
+        kwargs.pop("n_keypoints", None)
+        if family == "orbit":
+            return self.orbit_camera_trajectory(**kwargs)
+        if family == "hemisphere":
+            return self.hemisphere_camera_trajectory(**kwargs)
+        raise ValueError(f"unsupported trajectory: {family}")
 
     def init_space(self):
         raise NotImplementedError
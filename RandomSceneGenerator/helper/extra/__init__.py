@@ -1,11 +1,37 @@
 # flake8: noqa
 
-from . import _cupy as cupy
-
-from . import _open3d as open3d
+import importlib
 
 from . import _pybullet as pybullet
 
-from . import _pyglet as pyglet
 
-from . import _trimesh as trimesh
+class _LazyModule:
+    """Imports the submodule on first attribute access, to keep worker startup fast"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name, __name__)
+        return self._module
+
+    def __getattr__(self, attr):
+        # only called for attributes missing on the wrapper itself
+        if attr.startswith("__") or attr in ("_name", "_module"):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+# helpers with heavy or visualization-only dependencies
+cupy = _LazyModule("._cupy")
+
+open3d = _LazyModule("._open3d")
+
+pyglet = _LazyModule("._pyglet")
+
+trimesh = _LazyModule("._trimesh")
@@ -1,11 +1,27 @@
-from chainer.backends import cuda
-import chainer.functions as F
-
 import numpy as np
 
 
 def _resize_image_float(x, output_shape):
-    return F.resize_images(x[None], output_shape)[0].array
+    """Bilinear resize of a CHW image, aligning the corner pixels"""
+    _, in_height, in_width = x.shape
+    out_height, out_width = output_shape
+
+    def coordinates(n_in, n_out):
+        if n_out == 1:
+            u = np.zeros(1)
+        else:
+            u = np.linspace(0, n_in - 1, n_out)
+        u0 = np.floor(u).astype(int)
+        u1 = np.minimum(u0 + 1, n_in - 1)
+        return u0, u1, (u - u0).astype(x.dtype)
+
+    v0, v1, dv = coordinates(in_height, out_height)
+    u0, u1, du = coordinates(in_width, out_width)
+    dv = dv[:, None]
+
+    top = x[:, v0][:, :, u0] * (1 - du) + x[:, v0][:, :, u1] * du
+    bottom = x[:, v1][:, :, u0] * (1 - du) + x[:, v1][:, :, u1] * du
+    return top * (1 - dv) + bottom * dv
 
 
 def resize_image(x, output_shape, order):
@@ -45,18 +61,16 @@ def resize_image(x, output_shape, order):
 
 
 def median(x, axis=None):
-    xp = cuda.get_array_module(x)
-
     if axis is None:
         x = x.flatten()
         axis = 0
 
     n = x.shape[axis]
-    s = xp.sort(x, axis)
+    s = np.sort(x, axis)
 
-    m_odd = xp.take(s, n // 2, axis)
+    m_odd = np.take(s, n // 2, axis)
     if n % 2 == 1:
         return m_odd
     else:
-        m_even = xp.take(s, n // 2 - 1, axis)
+        m_even = np.take(s, n // 2 - 1, axis)
         return (m_odd + m_even) / 2
@@ -1,7 +1,6 @@
 import typing
 
 import numpy as np
-import trimesh
 
 from .. import geometry
 
@@ -112,9 +111,10 @@ def shape_id_to_str(shape_id: int) -> str:
     return id_to_str[shape_id]
 
 
-def get_trimesh_scene(axis: bool = False, bbox: bool = False) -> trimesh.Scene:
+def get_trimesh_scene(axis: bool = False, bbox: bool = False) -> "trimesh.Scene":
     """Returns trimesh scene."""
     import pybullet
+    import trimesh
 
     scene = trimesh.Scene()
     for unique_id in unique_ids:
@@ -1,9 +1,15 @@
 from . import trajectory
 
+from .camera import fov_from_fovy
+
+from .camera import intrinsic_matrix
+
 from .compose_transform import compose_transform
 
 from .look_at import look_at
 
 from .points_from_angles import points_from_angles
 
+from .pose import quaternion_matrix
 
+from .pose import transform_from_pose
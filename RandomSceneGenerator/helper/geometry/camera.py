@@ -0,0 +1,29 @@
+import math
+
+import numpy as np
+
+
+def fov_from_fovy(resolution, fovy):
+    """Returns (fovx, fovy) in degrees given the image size (width, height) and fovy in degrees."""
+    width, height = resolution
+    fovx = 2 * math.atan(math.tan(math.radians(fovy) * 0.5) * width / height)
+    return math.degrees(fovx), fovy
+
+
+def intrinsic_matrix(resolution, fov):
+    """Returns the (3, 3) intrinsic matrix of a pinhole camera.
+
+    Parameters
+    ----------
+    resolution: tuple
+        Image size: (width, height).
+    fov: tuple
+        Field of view (fovx, fovy) in degrees.
+    """
+    resolution = np.asarray(resolution, dtype=np.float64)
+    focal = resolution / (2.0 * np.tan(np.radians(np.asarray(fov, dtype=np.float64) / 2.0)))
+    K = np.eye(3, dtype=np.float64)
+    K[0, 0] = focal[0]
+    K[1, 1] = focal[1]
+    K[:2, 2] = resolution / 2.0
+    return K
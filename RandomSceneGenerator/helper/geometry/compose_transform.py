@@ -1,70 +1,50 @@
-import chainer
-from chainer.backends import cuda
-
-
-class ComposeTransform(chainer.Function):
-    def check_type_forward(self, in_types):
-        chainer.utils.type_check.expect(in_types.size() == 2)
-
-        R_type, t_type = in_types
-        chainer.utils.type_check.expect(
-            R_type.ndim == 3,  # N, 3, 3
-            R_type.shape[0] == t_type.shape[0],
-            R_type.shape[1:3] == (3, 3),
-            t_type.ndim == 2,  # N, 3
-            t_type.shape[1] == 3,
-        )
-
-    def forward(self, inputs):
-        xp = cuda.get_array_module(*inputs)
-        R, t = inputs
-
-        batch_size = R.shape[0]
-        T = xp.eye(4, dtype=R.dtype)
-        T = T[None].repeat(batch_size, axis=0)
-
-        T[:, :3, :3] = R
-        T[:, :3, 3] = t
-        return (T,)
-
-    def backward(self, inputs, gy):
-        (gT,) = gy
-        gR = gT[:, :3, :3]
-        gt = gT[:, :3, 3]
-        return gR, gt
-
-
-def compose_transform_function(R, t):
-    squeeze_axis0 = False
-    if R.ndim == 2 and t.ndim == 1:
-        R = R[None]  # 3x3 -> 1x3x3
-        t = t[None]  # 4 -> 1x4
-        squeeze_axis0 = True
-
-    matrix = ComposeTransform()(R, t)
-
-    if squeeze_axis0:
-        matrix = matrix[0, :, :]
-    return matrix
-
-
+import numpy as np
 
 
 def compose_transform(R=None, t=None):
-    xp = cuda.get_array_module(R, t)
-
+    """Returns the homogeneous transformation(s) with rotation R and translation t.
+
+    Parameters
+    ----------
+    R: (3, 3) or (N, 3, 3) float, optional
+        Rotation matrix, identity if None.
+    t: (3,) or (N, 3) float, optional
+        Translation, zero if None.
+
+    Returns
+    -------
+    T: (4, 4) or (N, 4, 4) float
+        Batched if R or t is batched.
+    """
+    if R is not None:
+        R = np.asarray(R)
+    if t is not None:
+        t = np.asarray(t)
+
+    batched = (R is not None and R.ndim == 3) or (t is not None and t.ndim == 2)
+    if not batched:
+        R = None if R is None else R[None]
+        t = None if t is None else t[None]
+
+    if R is not None:
+        assert R.shape[1:] == (3, 3), "R must be (3, 3) or (N, 3, 3)"
+    if t is not None:
+        assert t.shape[1:] == (3,), "t must be (3,) or (N, 3)"
+
+    batch_size = max(1 if R is None else len(R), 1 if t is None else len(t))
+    dtype = float
+    if R is not None and np.issubdtype(R.dtype, np.floating):
+        dtype = R.dtype
+
+    T = np.zeros((batch_size, 4, 4), dtype=dtype)
+    T[:, 3, 3] = 1
     if R is None:
-        Rs = xp.eye(3)[None]
+        T[:, :3, :3] = np.eye(3)
     else:
-        Rs = R[None]
-
-    if t is None:
-        ts = xp.zeros((1, 3))
-    else:
-        ts = t[None]
-
-    with chainer.no_backprop_mode():
-        Ts = compose_transform_function(Rs, ts).array
-        T = Ts[0]
+        T[:, :3, :3] = R
+    if t is not None:
+        T[:, :3, 3] = t
 
-    return T
\ No newline at end of file
+    if not batched:
+        T = T[0]
+    return T
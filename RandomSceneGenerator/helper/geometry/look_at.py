@@ -6,8 +6,11 @@ from .compose_transform import compose_transform
 
 
 def normalize(x: np.ndarray) -> np.ndarray:
-    assert x.ndim == 1, "x must be a vector (ndim: 1)"
-    return x / np.linalg.norm(x)
+    """Normalizes a vector (3,) or every row of (N, 3)"""
+    assert x.ndim in (1, 2), "x must be a vector or a batch of vectors"
+    # a batched dot product rounds like np.linalg.norm of a single vector
+    norm = np.sqrt(x[..., None, :] @ x[..., :, None])[..., 0]
+    return x / norm
 
 
 def look_at(
@@ -19,17 +22,18 @@ def look_at(
 
     Parameters
     ----------
-    eye: (3,) float
+    eye: (3,) or (N, 3) float
         Camera position.
-    target: (3,) float
+    target: (3,) or (N, 3) float
         Camera look_at position.
-    up: (3,) float
+    up: (3,) or (N, 3) float
         Vector that defines y-axis of camera (z-axis is vector from eye to at).
 
     Returns
     -------
-    T_cam2world: (4, 4) float (if return_homography is True)
-        Homography transformation matrix from camera to world.
+    T_cam2world: (4, 4) or (N, 4, 4) float
+        Homography transformation matrix from camera to world, batched if any
+        of the inputs is batched.
         Points are transformed like below:
             # x: camera coordinate, y: world coordinate
             y = trimesh.transforms.transform_points(x, T_cam2world)
@@ -49,18 +53,22 @@ def look_at(
     else:
         up = np.asarray(up, dtype=float)
 
-    assert eye.shape == (3,), "eye must be (3,) float"
-    assert target.shape == (3,), "target must be (3,) float"
-    assert up.shape == (3,), "up must be (3,) float"
+    for name, x in (("eye", eye), ("target", target), ("up", up)):
+        assert x.shape[-1:] == (3,) and x.ndim in (1, 2), f"{name} must be (3,) or (N, 3) float"
+
+    batched = max(eye.ndim, target.ndim, up.ndim) == 2
+    eye, target, up = np.broadcast_arrays(np.atleast_2d(eye), np.atleast_2d(target), np.atleast_2d(up))
 
     # create new axes
     z_axis: np.ndarray = normalize(target - eye)
     x_axis: np.ndarray = normalize(np.cross(up, z_axis))
     y_axis: np.ndarray = normalize(np.cross(z_axis, x_axis))
 
-    # create rotation matrix: [bs, 3, 3]
-    R: np.ndarray = np.vstack((x_axis, y_axis, z_axis))
+    # create rotation matrix: [bs, 3, 3], the axes are its columns
+    R: np.ndarray = np.stack((x_axis, y_axis, z_axis), axis=-1)
     t: np.ndarray = eye
 
-    T_cam2world: np.ndarray = compose_transform(R=R.T, t=t)
+    T_cam2world: np.ndarray = compose_transform(R=R, t=t)
+    if not batched:
+        T_cam2world = T_cam2world[0]
     return T_cam2world
@@ -1,25 +1,23 @@
-from chainer.backends import cuda
+import numpy as np
 
 
 def points_from_angles(
     distance, elevation, azimuth, is_degree: bool = True,
 ):
-    xp = cuda.get_array_module(distance)
-
-    distance = xp.asarray(distance)
-    elevation = xp.asarray(elevation)
-    azimuth = xp.asarray(azimuth)
+    distance = np.asarray(distance)
+    elevation = np.asarray(elevation)
+    azimuth = np.asarray(azimuth)
     if is_degree:
-        elevation = xp.radians(elevation)
-        azimuth = xp.radians(azimuth)
+        elevation = np.radians(elevation)
+        azimuth = np.radians(azimuth)
 
     assert distance.shape == elevation.shape == azimuth.shape
     assert distance.ndim in (0, 1)
 
-    return xp.stack(
+    return np.stack(
         [
-            distance * xp.cos(elevation) * xp.sin(azimuth),
-            -distance * xp.cos(elevation) * xp.cos(azimuth),
-            distance * xp.sin(elevation),
+            distance * np.cos(elevation) * np.sin(azimuth),
+            -distance * np.cos(elevation) * np.cos(azimuth),
+            distance * np.sin(elevation),
         ]
     ).transpose()
@@ -0,0 +1,49 @@
+import numpy as np
+
+from .compose_transform import compose_transform
+
+
+def quaternion_matrix(quaternions):
+    """Returns the rotation matrices of quaternions in (x, y, z, w) order.
+
+    Parameters
+    ----------
+    quaternions: (4,) or (N, 4) float
+        Quaternions, they do not need to be normalized.
+
+    Returns
+    -------
+    R: (3, 3) or (N, 3, 3) float
+    """
+    q = np.asarray(quaternions, dtype=float)
+    x, y, z, w = np.moveaxis(q, -1, 0)
+
+    # same operation order as Bullet's btMatrix3x3::setRotation, so that the
+    # result matches pybullet.getMatrixFromQuaternion
+    s = 2.0 / (x * x + y * y + z * z + w * w)
+    xs, ys, zs = x * s, y * s, z * s
+    wx, wy, wz = w * xs, w * ys, w * zs
+    xx, xy, xz = x * xs, x * ys, x * zs
+    yy, yz, zz = y * ys, y * zs, z * zs
+
+    R = np.stack([
+        1.0 - (yy + zz), xy - wz, xz + wy,
+        xy + wz, 1.0 - (xx + zz), yz - wx,
+        xz - wy, yz + wx, 1.0 - (xx + yy),
+    ], axis=-1)
+    return R.reshape(q.shape[:-1] + (3, 3))
+
+
+def transform_from_pose(poses):
+    """Returns the transformations of poses given as (x, y, z, qx, qy, qz, qw).
+
+    Parameters
+    ----------
+    poses: (7,) or (N, 7) float
+
+    Returns
+    -------
+    T: (4, 4) or (N, 4, 4) float
+    """
+    poses = np.asarray(poses, dtype=float)
+    return compose_transform(R=quaternion_matrix(poses[..., 3:]), t=poses[..., :3])
@@ -1,37 +1,52 @@
 import numpy as np
-import scipy.spatial
 import scipy.interpolate
 
+from .look_at import look_at
+from .points_from_angles import points_from_angles
+
+# camera trajectories of SceneGenerationBase.camera_trajectory
+FAMILIES = ("spline", "orbit", "hemisphere")
+
+
+def _squared_distances(a, b):
+    return ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=-1)
+
+
 def sort(points):
+    """Orders the points greedily by nearest neighbour, starting at the first one"""
     assert points.ndim == 2, "points must be 2 dimensional"
     assert points.shape[1] == 3, "points shape must be (N, 3)"
 
-    points_left = points.copy()[1:]
-    points_sorted = [points[0]]
-    while len(points_sorted) < (len(points) - 1):  # drop last point
-        kdtree = scipy.spatial.KDTree(points_left)
-        _, index = kdtree.query(points_sorted[-1])
-        points_sorted.append(kdtree.data[index])
-        points_left = points_left[np.arange(len(points_left)) != index]
-    points_sorted = np.array(points_sorted, dtype=float)
+    distances = _squared_distances(points, points)
+    visited = np.zeros(len(points), dtype=bool)
+    index = 0
+    visited[index] = True
+    order = [index]
+    while len(order) < (len(points) - 1):  # drop last point
+        candidates = np.where(visited, np.inf, distances[index])
+        index = int(np.argmin(candidates))
+        visited[index] = True
+        order.append(index)
+    points_sorted = np.array(points[order], dtype=float)
     return points_sorted
 
 
 def sort_by(points, key):
+    """Assigns to every key, in order, the nearest of the points not taken yet"""
     assert points.ndim == 2, "points must be 2 dimensional"
     assert points.shape[1] == 3, "points shape must be (N, 3)"
     assert key.ndim == 2, "key must be 2 dimensional"
     assert key.shape[1] == 3, "key shape must be (N, 3)"
     assert len(points) == len(key), "points and key must be same size"
 
-    points_sorted = []
-    points_left = points.copy()
-    for key_i in key:
-        kdtree = scipy.spatial.KDTree(points_left)
-        _, index = kdtree.query(key_i)
-        points_sorted.append(points_left[index])
-        points_left = points_left[np.arange(len(points_left)) != index]
-    points_sorted = np.array(points_sorted)
+    distances = _squared_distances(key, points)
+    taken = np.zeros(len(points), dtype=bool)
+    order = []
+    for distances_i in distances:
+        index = int(np.argmin(np.where(taken, np.inf, distances_i)))
+        taken[index] = True
+        order.append(index)
+    points_sorted = points[order]
     return points_sorted
 
 
@@ -42,12 +57,38 @@ def interpolate(keypoints, n_points):
     return points
 
 
-# def random(xyz_min, xyz_max, n_keypoints=12, n_points=None):
-#     if n_points is None:
-#         n_points = n_keypoints * 6
-#
-#     keypoints = np.random.uniform(xyz_min, xyz_max, (n_keypoints, 3))
-#     keypoints = sort(keypoints)
-#
-#     points = interpolate(keypoints, n_points)
-#     return points
+def orbit(center, distance, elevation, n_points, azimuth_start=0, turns=1):
+    """
+    Eyes on a circle around `center` at a fixed distance and elevation (degrees),
+    as (n_points, 3)
+    """
+    azimuth = azimuth_start + np.linspace(0, 360 * turns, n_points, endpoint=False)
+    eyes = points_from_angles(
+        np.full(n_points, distance, dtype=float),
+        np.full(n_points, elevation, dtype=float),
+        azimuth,
+    )
+    return eyes + np.asarray(center, dtype=float)
+
+
+def hemisphere(center, distance, n_points, elevation=(0, 90), azimuth_start=0):
+    """
+    Eyes covering the band of elevations (degrees) of the sphere around
+    `center` evenly, on a Fibonacci lattice, as (n_points, 3)
+    """
+    # uniform in the sine of the elevation gives uniform area
+    low, high = np.sin(np.radians(elevation))
+    sin_elevation = low + (high - low) * (np.arange(n_points) + 0.5) / n_points
+    golden_angle = 180 * (3 - np.sqrt(5))
+    azimuth = azimuth_start + golden_angle * np.arange(n_points)
+    eyes = points_from_angles(
+        np.full(n_points, distance, dtype=float),
+        np.degrees(np.arcsin(sin_elevation)),
+        azimuth % 360,
+    )
+    return eyes + np.asarray(center, dtype=float)
+
+
+def poses(eyes, targets, up=None):
+    """Camera to world transformations (N, 4, 4) looking from `eyes` at `targets`"""
+    return look_at(np.atleast_2d(eyes), targets, up)
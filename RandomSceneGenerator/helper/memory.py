@@ -0,0 +1,158 @@
+"""
+Memory measurements of worker processes: RSS from /proc and Python/NumPy
+allocations from tracemalloc
+"""
+import re
+import threading
+import time
+import tracemalloc
+
+
+_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(size):
+    """Parses sizes like '512M', '16G' or '1.5T' into bytes"""
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.match(r"^\s*([0-9.]+)\s*([KMGT]?)i?B?\s*$", size, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"invalid size: {size!r}")
+    value, unit = match.groups()
+    return int(float(value) * _UNITS[unit.upper()])
+
+
+def format_size(n_bytes):
+    for unit in ("B", "K", "M", "G"):
+        if abs(n_bytes) < 1024:
+            return f"{n_bytes:.1f}{unit}"
+        n_bytes /= 1024
+    return f"{n_bytes:.1f}T"
+
+
+def _read_status(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as fp:
+            for line in fp:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def rss_bytes(pid="self"):
+    """Current resident set size of a process, None if it is gone"""
+    return _read_status(pid, "VmRSS")
+
+
+def peak_rss_bytes(pid="self"):
+    """Peak resident set size of a process, None if it is gone"""
+    return _read_status(pid, "VmHWM")
+
+
+def available_bytes():
+    """Memory available for new processes without swapping"""
+    with open("/proc/meminfo") as fp:
+        for line in fp:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    raise OSError("MemAvailable missing from /proc/meminfo")
+
+
+class RSSSampler(threading.Thread):
+    """Background thread keeping the maximum RSS of this process since the last reset"""
+
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_bytes() or 0
+        self._lock = threading.Lock()
+
+    def run(self):
+        while True:
+            rss = rss_bytes() or 0
+            with self._lock:
+                if rss > self.peak:
+                    self.peak = rss
+            time.sleep(self.interval)
+
+    def reset(self):
+        """Restarts the maximum from the current RSS and returns the previous maximum"""
+        rss = rss_bytes() or 0
+        with self._lock:
+            peak, self.peak = max(self.peak, rss), rss
+        return peak
+
+    def raise_to(self, value):
+        with self._lock:
+            self.peak = max(self.peak, value)
+
+    def read(self):
+        rss = rss_bytes() or 0
+        with self._lock:
+            self.peak = max(self.peak, rss)
+            return self.peak
+
+
+class MemoryProbe:
+    """
+    Measures the peak RSS and the peak of traced allocations of (nested) stages
+
+    The peaks of a stage include its nested stages. tracemalloc can only reset
+    its peak from Python 3.9 on, on older versions the traced peak is only
+    measured for the scene as a whole.
+    """
+
+    def __init__(self, trace=True, interval=0.01):
+        self._sampler = RSSSampler(interval=interval)
+        self._sampler.start()
+        self._trace = trace
+        self._reset_traced_peak = getattr(tracemalloc, "reset_peak", None)
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # per open scene or stage: [RSS peak of the parent so far, traced baseline, traced peak of nested stages]
+        self._stack = [[0, 0, 0]]
+
+    def _open(self):
+        rss_parent = self._sampler.reset()
+        traced_current = 0
+        if self._trace and self._reset_traced_peak is not None:
+            traced_current, traced_peak = tracemalloc.get_traced_memory()
+            # keep the parent's traced peak before resetting it
+            self._stack[-1][2] = max(self._stack[-1][2], traced_peak)
+            self._reset_traced_peak()
+        self._stack.append([rss_parent, traced_current, 0])
+
+    def _close(self):
+        rss_parent, traced_baseline, traced_nested = self._stack.pop()
+        rss_peak = self._sampler.reset()
+        # the parent's peak includes this stage
+        self._sampler.raise_to(max(rss_parent, rss_peak))
+        values = dict(peak_rss=rss_peak)
+        if self._trace:
+            _, traced_peak = tracemalloc.get_traced_memory()
+            traced_peak = max(traced_peak, traced_nested)
+            values["peak_traced"] = traced_peak - traced_baseline
+            if self._stack:
+                self._stack[-1][2] = max(self._stack[-1][2], traced_peak)
+        return values
+
+    def start(self, name):
+        self._open()
+
+    def stop(self, name):
+        values = self._close()
+        if self._reset_traced_peak is None:
+            values.pop("peak_traced", None)
+        return values
+
+    def start_scene(self):
+        if self._trace and self._reset_traced_peak is None:
+            # restart to reset the peak
+            tracemalloc.stop()
+            tracemalloc.start()
+        self._open()
+
+    def end_scene(self):
+        return self._close()
@@ -0,0 +1,248 @@
+"""
+Stage timings and counters of the dataset generation, written as JSON lines
+
+Every worker process appends one record per scene to its own file
+`<metrics_dir>/<kind>-<host>-<pid>.jsonl`. Instrumented code calls the module
+level `stage` and `count` functions, which do nothing unless `enable` was
+called in the process. With `enable(..., memory=True)` the peak RSS and
+traced allocations of every stage are recorded too (see helper/memory.py).
+
+Summary of a metrics folder (from RandomSceneGenerator):
+    python -m helper.metrics <metrics_dir>
+"""
+import argparse
+import collections
+import glob
+import json
+import os
+import socket
+import time
+
+from helper.memory import MemoryProbe, format_size
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, recorder, name):
+        self._recorder = recorder
+        self._name = name
+
+    def __enter__(self):
+        if self._recorder.probe is not None:
+            self._recorder.probe.start(self._name)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._start
+        stage = self._recorder.stages[self._name]
+        stage["time"] += elapsed
+        stage["calls"] += 1
+        if self._recorder.probe is not None:
+            for key, value in self._recorder.probe.stop(self._name).items():
+                stage[key] = max(stage.get(key, value), value)
+        return False
+
+
+class Recorder:
+    """Accumulates the stage timings and counters of the current scene"""
+
+    def __init__(self, metrics_dir, kind, memory=False):
+        self.metrics_dir = metrics_dir
+        self.kind = kind
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+        self.filename = os.path.join(metrics_dir, f"{kind}-{self.worker}.jsonl")
+        self.probe = None
+        if memory:
+            self.probe = MemoryProbe()
+        self._reset()
+
+    def _reset(self):
+        self.scene = None
+        self.info = {}
+        self.stages = collections.defaultdict(lambda: dict(time=0.0, calls=0))
+        self.counters = collections.Counter()
+        self._start = None
+
+    def start_scene(self, scene, **info):
+        self._reset()
+        self.scene = scene
+        self.info.update(info)
+        if self.probe is not None:
+            self.probe.start_scene()
+        self._start = time.time()
+
+    def end_scene(self, **info):
+        end = time.time()
+        if self.probe is not None:
+            self.info["memory"] = self.probe.end_scene()
+        self.info.update(info)
+        record = dict(
+            kind=self.kind,
+            worker=self.worker,
+            scene=self.scene,
+            start=self._start,
+            end=end,
+            wall=end - self._start,
+            stages=dict(self.stages),
+            counters=dict(self.counters),
+            **self.info
+        )
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        with open(self.filename, "a") as fp:
+            fp.write(json.dumps(record) + "\n")
+        self._reset()
+        return record
+
+
+_recorder = None
+
+
+def enable(metrics_dir, kind, memory=False):
+    """Starts recording metrics of this process into `metrics_dir`"""
+    global _recorder
+    _recorder = Recorder(metrics_dir, kind, memory=memory)
+    return _recorder
+
+
+def disable():
+    global _recorder
+    _recorder = None
+
+
+def recorder():
+    return _recorder
+
+
+def stage(name):
+    """Context manager timing a stage of the current scene"""
+    if _recorder is None:
+        return _NULL_STAGE
+    return _Stage(_recorder, name)
+
+
+def count(name, n=1):
+    if _recorder is not None:
+        _recorder.counters[name] += n
+
+
+def start_scene(scene, **info):
+    if _recorder is not None:
+        _recorder.start_scene(scene, **info)
+
+
+def end_scene(**info):
+    if _recorder is not None:
+        return _recorder.end_scene(**info)
+
+
+def load(metrics_dir):
+    records = []
+    for filename in sorted(glob.glob(os.path.join(metrics_dir, "*.jsonl"))):
+        with open(filename) as fp:
+            for line in fp:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    return records
+
+
+def summarize(records, percentiles=(50, 90, 99)):
+    """
+    Aggregates scene records per kind of worker into per-stage percentiles
+    (of the per-scene stage time) and scenes per hour
+    """
+    import numpy as np
+
+    by_kind = collections.defaultdict(list)
+    for record in records:
+        by_kind[record["kind"]].append(record)
+
+    memory_keys = ("peak_rss", "peak_traced")
+
+    summary = {}
+    for kind, kind_records in sorted(by_kind.items()):
+        span = max(r["end"] for r in kind_records) - min(r["start"] for r in kind_records)
+        stage_names = sorted({name for r in kind_records for name in r["stages"]})
+        counter_names = sorted({name for r in kind_records for name in r["counters"]})
+
+        stages = {}
+        for name in ["wall"] + stage_names:
+            if name == "wall":
+                values = np.array([r["wall"] for r in kind_records])
+                measured = [r.get("memory", {}) for r in kind_records]
+            else:
+                values = np.array([r["stages"].get(name, {}).get("time", 0.0) for r in kind_records])
+                measured = [r["stages"].get(name, {}) for r in kind_records]
+            stats = dict(mean=float(values.mean()), total=float(values.sum()))
+            for p in percentiles:
+                stats[f"p{p}"] = float(np.percentile(values, p))
+            if name != "wall":
+                stats["calls"] = float(np.mean([r["stages"].get(name, {}).get("calls", 0) for r in kind_records]))
+            for key in memory_keys:
+                key_values = [m[key] for m in measured if key in m]
+                if key_values:
+                    stats[f"{key}_p90"] = float(np.percentile(key_values, 90))
+                    stats[f"{key}_max"] = float(max(key_values))
+            stages[name] = stats
+
+        counters = {
+            name: float(np.mean([r["counters"].get(name, 0) for r in kind_records]))
+            for name in counter_names
+        }
+
+        summary[kind] = dict(
+            n_scenes=len(kind_records),
+            n_workers=len({r["worker"] for r in kind_records}),
+            scenes_per_hour=len(kind_records) / span * 3600 if span > 0 else float("nan"),
+            stages=stages,
+            counters=counters,
+        )
+    return summary
+
+
+def print_summary(summary):
+    for kind, kind_summary in summary.items():
+        print(f"==> {kind}: {kind_summary['n_scenes']} scenes, {kind_summary['n_workers']} workers, "
+              f"{kind_summary['scenes_per_hour']:.1f} scenes/hour")
+        print(f"{'stage':<20}{'calls':>10}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'total':>12}"
+              f"{'max rss':>12}{'max traced':>12}")
+        for name, stats in kind_summary["stages"].items():
+            calls = f"{stats['calls']:.1f}" if "calls" in stats else "-"
+            rss = format_size(stats["peak_rss_max"]) if "peak_rss_max" in stats else "-"
+            traced = format_size(stats["peak_traced_max"]) if "peak_traced_max" in stats else "-"
+            print(f"{name:<20}{calls:>10}{stats['mean']:>10.3f}{stats['p50']:>10.3f}"
+                  f"{stats['p90']:>10.3f}{stats['p99']:>10.3f}{stats['total']:>12.1f}{rss:>12}{traced:>12}")
+        if kind_summary["counters"]:
+            print("counters (mean per scene):")
+            for name, value in kind_summary["counters"].items():
+                print(f"  {name:<24}{value:>12.1f}")
+        print()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument('metrics_dir', help='folder with the metrics .jsonl files')
+    parser.add_argument('--json', action='store_true', help='print the summary as json')
+
+    args = parser.parse_args()
+
+    summary = summarize(load(args.metrics_dir))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
@@ -0,0 +1,157 @@
+"""
+Opt-in profiling of a sample of the scenes handled by each worker
+
+Sampled scenes run under cProfile and every worker process dumps its profile
+to `<profile_dir>/<kind>-<host>-<pid>.prof`. Unsampled scenes, and all scenes
+when profiling is off, run without any profiler.
+
+Merge the worker profiles into `merged.prof` and a flamegraph-compatible
+collapsed-stack file `merged.collapsed`:
+    python -m helper.profiling <profile_dir>
+"""
+import argparse
+import collections
+import glob
+import os
+import socket
+import zlib
+
+
+class _NullProfile:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PROFILE = _NullProfile()
+
+
+def is_sampled(key, fraction):
+    """Deterministically selects a `fraction` of the scenes, by scene key"""
+    if fraction <= 0:
+        return False
+    if fraction >= 1:
+        return True
+    return zlib.crc32(str(key).encode()) / 2 ** 32 < fraction
+
+
+class _SceneProfile:
+    def __init__(self, profile_dir, kind):
+        import cProfile
+
+        self.filename = os.path.join(
+            profile_dir, f"{kind}-{socket.gethostname()}-{os.getpid()}.prof"
+        )
+        self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.disable()
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        # the profiler accumulates over all sampled scenes of the worker
+        self.profiler.dump_stats(self.filename)
+        return False
+
+
+_profiles = {}
+
+
+def profile_scene(key, fraction, profile_dir, kind):
+    """Context manager profiling the scene `key` if it is part of the sample"""
+    if not is_sampled(key, fraction):
+        return _NULL_PROFILE
+    if kind not in _profiles or _profiles[kind][0] != os.getpid():
+        _profiles[kind] = os.getpid(), _SceneProfile(profile_dir, kind)
+    return _profiles[kind][1]
+
+
+def _function_name(func):
+    filename, line, name = func
+    if filename == "~":
+        # built-in functions, e.g. "<built-in method pybullet.stepSimulation>"
+        return name.strip("<>")
+    return f"{os.path.basename(filename)}:{name}:{line}"
+
+
+def stats_to_collapsed(stats, min_time=1e-4, max_depth=64):
+    """
+    Converts cProfile statistics into collapsed stacks ("a;b;c <microseconds>")
+
+    cProfile only keeps caller -> callee edges, so the time of a function is
+    split between its callers in proportion to the time spent under each
+    caller, like flameprof and similar tools do.
+    """
+    callees = collections.defaultdict(dict)
+    roots = []
+    for func, (_, _, _, cumtime, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, (_, _, _, edge_cumtime) in callers.items():
+            callees[caller][func] = edge_cumtime
+
+    stacks = collections.Counter()
+
+    def walk(func, stack, time):
+        _, _, tottime, cumtime, _ = stats.stats[func]
+        stack = stack + (_function_name(func),)
+        if cumtime <= 0:
+            return
+        ratio = time / cumtime
+        stacks[stack] += tottime * ratio
+        if len(stack) >= max_depth:
+            return
+        for callee, edge_cumtime in callees[func].items():
+            callee_time = edge_cumtime * ratio
+            if callee_time < min_time or _function_name(callee) in stack:
+                continue
+            walk(callee, stack, callee_time)
+
+    for root in roots:
+        walk(root, (), stats.stats[root][3])
+
+    lines = []
+    for stack, time in sorted(stacks.items()):
+        microseconds = int(round(time * 1e6))
+        if microseconds > 0:
+            lines.append(";".join(stack) + f" {microseconds}")
+    return lines
+
+
+def merge(profile_dir, out_prefix=None):
+    """Merges the worker profiles of `profile_dir` into .prof and .collapsed files"""
+    import pstats
+
+    filenames = sorted(glob.glob(os.path.join(profile_dir, "*.prof")))
+    if out_prefix is None:
+        out_prefix = os.path.join(profile_dir, "merged")
+    filenames = [f for f in filenames if os.path.abspath(f) != os.path.abspath(out_prefix + ".prof")]
+    if not filenames:
+        raise ValueError(f"no worker profiles in {profile_dir}")
+
+    stats = pstats.Stats(*filenames)
+    stats.dump_stats(out_prefix + ".prof")
+    with open(out_prefix + ".collapsed", "w") as fp:
+        for line in stats_to_collapsed(stats):
+            fp.write(line + "\n")
+    return stats
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument('profile_dir', help='folder with the worker .prof files')
+    parser.add_argument('--out', help='prefix of the merged files (default: <profile_dir>/merged)')
+    parser.add_argument('--top', type=int, help='print the top functions by cumulative time', default=30)
+
+    args = parser.parse_args()
+
+    stats = merge(args.profile_dir, args.out)
+    stats.sort_stats("cumulative").print_stats(args.top)
@@ -0,0 +1,91 @@
+import json
+import platform
+import subprocess
+
+import numpy as np
+import path
+
+
+PROVENANCE_FILE = "provenance.json"
+
+
+def scene_seed(base_seed, index):
+    """Returns the seed of scene `index` in a dataset seeded with `base_seed`.
+
+    The seed only depends on the global scene index, so the same scene gets
+    the same seed whichever shard or worker generates it.
+    """
+    sequence = np.random.SeedSequence([int(base_seed), int(index)])
+    return int(sequence.generate_state(1)[0])
+
+
+def parse_shard(shard):
+    """Parses a shard specification of the form 'i/N' into (i, N)."""
+    if shard is None:
+        return 0, 1
+    try:
+        shard_index, n_shards = (int(x) for x in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"invalid shard: {shard!r} (expected 'i/N')")
+    if n_shards < 1 or not 0 <= shard_index < n_shards:
+        raise ValueError(f"invalid shard: {shard!r} (expected 0 <= i < N)")
+    return shard_index, n_shards
+
+
+def shard_indices(n_scenes, shard_index, n_shards):
+    """Returns the global scene indices generated by shard `shard_index`."""
+    return list(range(shard_index, n_scenes, n_shards))
+
+
+def code_version():
+    """Returns the git revision of the code, with a '-dirty' suffix if the
+    working tree has local changes, or 'unknown' outside of a git checkout."""
+    here = path.Path(__file__).abspath().parent
+    try:
+        revision = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=here, stderr=subprocess.DEVNULL,
+        ).decode().strip()
+        status = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=here,
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    if status:
+        revision += "-dirty"
+    return revision
+
+
+def library_versions():
+    import pybullet
+
+    return dict(
+        python=platform.python_version(),
+        numpy=np.__version__,
+        pybullet=pybullet.getAPIVersion(),
+    )
+
+
+def write_provenance(scene_dir, seed, index, parameters, version=None):
+    """Writes the record needed to regenerate the scene in `scene_dir`."""
+    if version is None:
+        version = code_version()
+    record = dict(
+        index=int(index),
+        seed=int(seed),
+        code_version=version,
+        libraries=library_versions(),
+        parameters=parameters,
+    )
+    with open(path.Path(scene_dir) / PROVENANCE_FILE, "w") as fp:
+        json.dump(record, fp, indent=2, sort_keys=True)
+    return record
+
+
+def load_provenance(filename):
+    filename = path.Path(filename)
+    if filename.isdir():
+        filename = filename / PROVENANCE_FILE
+    with open(filename) as fp:
+        return json.load(fp)
@@ -0,0 +1,119 @@
+"""
+Runs jobs in child processes under a memory budget instead of a fixed process count
+"""
+import collections
+import multiprocessing
+import time
+
+import numpy as np
+
+from helper import memory
+
+
+def _run_job(target, args, kwargs, peak, slot, worker_init):
+    try:
+        if worker_init is not None:
+            worker_init(slot)
+        target(*args, **kwargs)
+    finally:
+        peak.value = memory.peak_rss_bytes() or 0
+
+
+class MemoryBudgetScheduler:
+    """
+    Starts one child process per job and admits the next job only while the
+    memory of the running jobs plus the estimate of the next job fits into
+    `max_memory` (and into the memory the system has available).
+
+    The memory of a running job is its current RSS or its estimate, whichever
+    is larger. Estimates are a linear fit of the peak RSS of finished jobs on
+    their size (e.g. the number of objects in the scene) times a safety
+    factor; `initial_estimate` is used until the first jobs finish. RSS counts
+    the pages shared with the parent in every child, so budgets are
+    conservative.
+
+    Every running job holds one of `max_workers` slots; `worker_init(slot)` is
+    called in the child before the job, e.g. to pin it to cpus.
+    """
+
+    def __init__(self, max_workers, max_memory=None, initial_estimate="2G", safety=1.2,
+                 poll_interval=0.05, verbose=True, worker_init=None):
+        self.max_workers = max_workers
+        self.worker_init = worker_init
+        self.max_memory = None if max_memory is None else memory.parse_size(max_memory)
+        self.initial_estimate = memory.parse_size(initial_estimate)
+        self.safety = safety
+        self.poll_interval = poll_interval
+        self.verbose = verbose
+        # (size, peak rss) of the finished jobs
+        self.observations = []
+
+    def estimate(self, size):
+        if not self.observations:
+            return self.initial_estimate
+        sizes, peaks = np.array(self.observations, dtype=float).T
+        if len(np.unique(sizes)) < 2:
+            predicted = peaks.max()
+        else:
+            slope, intercept = np.polyfit(sizes, peaks, 1)
+            predicted = intercept + max(slope, 0) * size
+            predicted = max(predicted, peaks.min())
+        return int(self.safety * predicted)
+
+    def _used(self, running):
+        used = 0
+        for process, _, estimate, _, _ in running.values():
+            rss = memory.rss_bytes(process.pid) or 0
+            used += max(rss, estimate)
+        return used
+
+    def _fits(self, estimate, running):
+        if self.max_memory is None or not running:
+            return True
+        if self._used(running) + estimate > self.max_memory:
+            return False
+        return estimate <= memory.available_bytes()
+
+    def run(self, target, jobs, kwargs=None):
+        """
+        Runs target(*args, **kwargs) for every (args, size) in `jobs`, in order
+        of admission. Returns the (size, peak rss) of every finished job.
+        """
+        if kwargs is None:
+            kwargs = {}
+        pending = collections.deque(jobs)
+        running = {}
+        free_slots = list(range(self.max_workers))
+        n_started = 0
+
+        while pending or running:
+            for job_id, (process, size, _, peak, slot) in list(running.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                if peak.value > 0:
+                    self.observations.append((size, peak.value))
+                free_slots.append(slot)
+                del running[job_id]
+
+            while pending and len(running) < self.max_workers:
+                args, size = pending[0]
+                estimate = self.estimate(size)
+                if not self._fits(estimate, running):
+                    break
+                pending.popleft()
+                free_slots.sort()
+                slot = free_slots.pop(0)
+                peak = multiprocessing.Value("q", 0, lock=False)
+                process = multiprocessing.Process(target=_run_job,
+                                                  args=(target, args, kwargs, peak, slot, self.worker_init))
+                process.start()
+                running[n_started] = (process, size, estimate, peak, slot)
+                n_started += 1
+                if self.verbose and self.max_memory is not None:
+                    print(f"started job {n_started} (size {size}, estimate {memory.format_size(estimate)}), "
+                          f"{len(running)} running")
+
+            time.sleep(self.poll_interval)
+
+        return list(self.observations)
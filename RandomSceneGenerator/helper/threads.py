@@ -0,0 +1,175 @@
+"""
+Thread pool sizes and CPU affinity of worker processes
+
+NumPy/SciPy (BLAS, OpenMP) and torch size their thread pools when they are
+first loaded, so the limits have to be set before the heavy imports:
+
+    from helper import threads
+    threads.configure_from_argv()
+
+    import numpy as np
+
+Forked workers then inherit the limits and can be pinned to cores or NUMA
+nodes with `pin_worker`. This module must not import NumPy itself.
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+
+
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+PIN_MODES = ("none", "core", "numa")
+
+
+def add_arguments(parser):
+    parser.add_argument('--threads_per_worker', type=int,
+                        help='threads of the NumPy/BLAS/torch pools of every process '
+                             '(default: number of cpus / number of processes)')
+    parser.add_argument('--pin', choices=PIN_MODES, default='none',
+                        help='pin every process to its own cores or to a NUMA node')
+
+
+def available_cpus():
+    """cpus this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def default_threads_per_worker(n_processes):
+    return max(1, len(available_cpus()) // max(1, n_processes))
+
+
+def configure_from_argv(argv=None):
+    """
+    Reads --n_processes (times --object_processes) and --threads_per_worker
+    from the command line and limits the thread pools accordingly. Must run
+    before NumPy is imported.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--n_processes', type=int)
+    parser.add_argument('--threads_per_worker', type=int)
+    # create_dataset.py can run the objects of every scene in a pool of its own
+    parser.add_argument('--object_processes', type=int, default=1)
+    # create_dataset.py defaults to one process per cpu under a memory budget
+    parser.add_argument('--max_memory')
+    args, _ = parser.parse_known_args(argv)
+
+    n_threads = args.threads_per_worker
+    if n_threads is None:
+        n_processes = args.n_processes
+        if n_processes is None:
+            n_processes = len(available_cpus()) if args.max_memory is not None else 1
+        n_threads = default_threads_per_worker(n_processes * max(1, args.object_processes))
+    limit_threads(n_threads)
+    return n_threads
+
+
+def limit_threads(n_threads):
+    """
+    Limits the thread pools of this process (and of the processes it starts)
+    to `n_threads`. Libraries that are already loaded are limited through
+    threadpoolctl and torch.set_num_threads.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(n_threads)
+
+    if "numpy" in sys.modules:
+        try:
+            import threadpoolctl
+        except ImportError:
+            pass
+        else:
+            threadpoolctl.threadpool_limits(n_threads)
+    if "torch" in sys.modules:
+        import torch
+
+        torch.set_num_threads(n_threads)
+
+
+def numa_nodes():
+    """cpus of every NUMA node, restricted to the available cpus"""
+    allowed = set(available_cpus())
+    nodes = []
+    for cpulist_file in sorted(glob.glob("/sys/devices/system/node/node*/cpulist"),
+                               key=lambda f: int(re.search(r"node(\d+)", f).group(1))):
+        with open(cpulist_file) as fp:
+            cpus = parse_cpulist(fp.read())
+        cpus = [cpu for cpu in cpus if cpu in allowed]
+        if cpus:
+            nodes.append(cpus)
+    if not nodes:
+        nodes = [sorted(allowed)]
+    return nodes
+
+
+def parse_cpulist(cpulist):
+    """Parses a kernel cpu list like '0-3,8-11' into a list of cpus"""
+    cpus = []
+    for part in cpulist.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def worker_cpus(slot, n_workers, mode, threads_per_worker=None):
+    """cpus of worker `slot` out of `n_workers` concurrent workers"""
+    if mode == "none":
+        return None
+    if mode == "numa":
+        nodes = numa_nodes()
+        return nodes[slot % len(nodes)]
+    if mode == "core":
+        cpus = available_cpus()
+        if threads_per_worker is None:
+            threads_per_worker = default_threads_per_worker(n_workers)
+        threads_per_worker = min(threads_per_worker, len(cpus))
+        start = (slot * threads_per_worker) % len(cpus)
+        return [cpus[(start + i) % len(cpus)] for i in range(threads_per_worker)]
+    raise ValueError(f"unsupported pin mode: {mode}")
+
+
+def pin_worker(slot, n_workers, mode, threads_per_worker=None):
+    """Pins the calling process to the cpus of worker `slot`"""
+    cpus = worker_cpus(slot, n_workers, mode, threads_per_worker)
+    if cpus is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    return cpus
+
+
+class WorkerInit:
+    """
+    Limits threads and pins workers, usable as worker_init of the scheduler
+    (called with the worker slot) or as worker_init_fn of a torch DataLoader
+    (called with the worker id)
+    """
+
+    def __init__(self, n_workers, threads_per_worker=None, pin="none", processes_per_worker=1):
+        self.n_workers = n_workers
+        self.threads_per_worker = threads_per_worker
+        self.pin = pin
+        # workers running a pool of their own share their cpus with it
+        self.processes_per_worker = processes_per_worker
+
+    def __call__(self, slot):
+        threads_per_worker = self.threads_per_worker
+        if threads_per_worker is None:
+            threads_per_worker = default_threads_per_worker(self.n_workers * self.processes_per_worker)
+        limit_threads(threads_per_worker)
+        pin_worker(slot, self.n_workers, self.pin, threads_per_worker * self.processes_per_worker)
@@ -1,5 +1,4 @@
 import re
-import gdown
 import path
 from model_loaders.modelbase import ModelsBase
 
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Regenerates a single scene from the provenance record written next to it by generate_dataset.py
+"""
+import argparse
+
+import path
+import pybullet
+
+from generate_dataset import create_scene
+from helper import provenance
+
+
+def regenerate_scene(provenance_file, out_dir, model_dir=None, connection_method=pybullet.DIRECT):
+    record = provenance.load_provenance(provenance_file)
+    parameters = dict(record['parameters'])
+
+    current_version = provenance.code_version()
+    if current_version != record['code_version']:
+        print(f"warning: scene was generated with code version {record['code_version']}, "
+              f"running {current_version}")
+    current_libraries = provenance.library_versions()
+    if current_libraries != record['libraries']:
+        print(f"warning: scene was generated with {record['libraries']}, running {current_libraries}")
+
+    if model_dir is None:
+        model_dir = parameters['model_dir']
+    parameters.pop('model_dir')
+    parameters.pop('n_objects')
+    min_objects = parameters.pop('min_objects')
+    max_objects = parameters.pop('max_objects')
+
+    create_scene(path.Path(out_dir),
+                 model_dir,
+                 index=record['index'],
+                 seed=record['seed'],
+                 connection_method=connection_method,
+                 min_objects=min_objects,
+                 max_objects=max_objects,
+                 generator_parameters=parameters)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument('provenance_file', help='provenance.json of the scene (or the scene folder)')
+    parser.add_argument('out_dir', help='destination path to the regenerated scene')
+    parser.add_argument('--model_dir', help='path to SQ models (default: path recorded in the provenance)')
+
+    args = parser.parse_args()
+
+    regenerate_scene(args.provenance_file, args.out_dir, model_dir=args.model_dir)
@@ -0,0 +1,110 @@
+"""
+Samples per second of VoxelGridLoader batches with and without the batched
+augmentation (DatasetCreation/augmentation.py), and of the same augmentation
+applied per sample in a Python loop. The batched augmentation is checked
+against the per-sample one first.
+
+    python benchmarks/augmentation.py /tmp/sq_benchmarks/objects4-workers1/scenes/benchmark --max_n_objects 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO_DIR, 'DatasetCreation'))
+
+from augmentation import GRID_KEYS, TSDFAugmentation
+from data_loader import VoxelGridLoader
+
+
+def augment_per_sample(batch, transforms, shifts):
+    """The transforms of TSDFAugmentation, one sample and grid at a time"""
+    out = dict(batch)
+    for key in GRID_KEYS:
+        if key not in batch:
+            continue
+        grids = []
+        for grid, transform, shift in zip(batch[key], transforms.tolist(), shifts.tolist()):
+            # (channels, x, y, z)
+            fill = 0 if key.endswith("_occ") else grid.amax(dim=(1, 2, 3), keepdim=True)
+            if transform >= 4:
+                grid = torch.flip(grid, dims=(1,))
+            grid = torch.rot90(grid, transform % 4, dims=(1, 2))
+            shifted = torch.zeros_like(grid) + fill
+            size = grid.shape[1]
+            sx, sy = shift
+            shifted[:, max(sx, 0):size + min(sx, 0), max(sy, 0):size + min(sy, 0)] = \
+                grid[:, max(-sx, 0):size + min(-sx, 0), max(-sy, 0):size + min(-sy, 0)]
+            grids.append(shifted)
+        out[key] = torch.stack(grids)
+    return out
+
+
+def samples_per_second(batches, augment=None):
+    start = time.perf_counter()
+    n = 0
+    for batch in batches:
+        if augment is not None:
+            augment(batch)
+        n += len(batch["scene"])
+    return n / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument('scene_dir', help='dataset created by create_dataset.py')
+    parser.add_argument('--max_n_objects', type=int, help='padding of the object grids', default=8)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--n_batches', type=int, help='batches per measurement', default=10)
+    parser.add_argument('--max_shift', type=int, help='largest translation in voxels', default=4)
+    parser.add_argument('--device', help='device of the augmentation', default='cpu')
+
+    args = parser.parse_args()
+
+    loader = VoxelGridLoader(args.scene_dir, args.max_n_objects)
+    data = torch.utils.data.DataLoader(loader, batch_size=args.batch_size, shuffle=True)
+    batches = []
+    while len(batches) < args.n_batches:
+        batches += [{key: value.to(args.device) for key, value in batch.items()} for batch in data]
+    batches = batches[:args.n_batches]
+
+    augment = TSDFAugmentation(max_shift=args.max_shift, generator=torch.Generator().manual_seed(0))
+    for batch in batches:
+        transforms, shifts = augment.sample(batch["scene"])
+        batched = {key: augment.apply(batch[key], transforms, shifts,
+                                      torch.zeros(batch[key].shape[:2], dtype=batch[key].dtype,
+                                                  device=batch[key].device) if key.endswith("_occ") else None)
+                   for key in GRID_KEYS if key in batch}
+        reference = augment_per_sample(batch, transforms, shifts)
+        if not all(torch.equal(batched[key], reference[key]) for key in batched):
+            raise AssertionError("batched and per-sample augmentation differ")
+        # the transforms keep the inside of the scene
+        if (batched["scene"] < 0).sum() != (batch["scene"] < 0).sum():
+            raise AssertionError("augmentation moved the scene out of the grid")
+    print("batched augmentation matches the per-sample one")
+
+    def per_sample(batch):
+        return augment_per_sample(batch, *augment.sample(batch["scene"]))
+
+    print(f"{len(loader)} scenes, batches of {args.batch_size}, device {args.device}")
+    print(f"{'':<28}{'samples/s':>10}")
+    results = {}
+    for name, function in (("loading", None), ("loading + batched", augment), ("loading + per sample", per_sample)):
+        start = time.perf_counter()
+        n = 0
+        for batch in data:
+            if function is not None:
+                function(batch)
+            n += len(batch["scene"])
+        results[name] = n / (time.perf_counter() - start)
+    for name, function in (("batched (in memory)", augment), ("per sample (in memory)", per_sample)):
+        results[name] = samples_per_second(batches, function)
+    for name, rate in results.items():
+        print(f"{name:<28}{rate:>10.1f}")
@@ -0,0 +1,60 @@
+"""
+Startup cost of a generation worker: the time a fresh interpreter needs to
+import generate_dataset.py and its dependencies
+
+Reports the wall time of the import (best of --repeat runs) and, with
+Python >= 3.7, the packages taking the most time according to
+`python -X importtime`.
+
+    python benchmarks/import_time.py
+"""
+import argparse
+import collections
+import os
+import subprocess
+import sys
+import time
+
+GENERATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RandomSceneGenerator')
+
+
+def import_wall_time(module, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", f"import {module}"], cwd=GENERATOR_DIR)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def import_time_by_package(module):
+    """Import time in seconds of every top-level package, summed over its modules"""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=GENERATOR_DIR,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True).stderr
+    packages = collections.Counter()
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_time, _, name = [field.strip() for field in line[len("import time:"):].split("|")]
+        packages[name.split(".")[0]] += int(self_time) * 1e-6
+    return packages
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument('--module', help='module imported by the worker', default='generate_dataset')
+    parser.add_argument('--repeat', type=int, help='number of runs, the fastest is reported', default=5)
+    parser.add_argument('--top', type=int, help='number of packages to list', default=15)
+
+    args = parser.parse_args()
+
+    print(f"import {args.module}: {import_wall_time(args.module, args.repeat):.3f}s (best of {args.repeat})")
+    if sys.version_info >= (3, 7):
+        packages = import_time_by_package(args.module)
+        for name, seconds in packages.most_common(args.top):
+            print(f"  {name:<32}{seconds:>8.3f}s")
@@ -0,0 +1,179 @@
+"""
+End-to-end benchmark of the scene generation and the TSDF creation
+
+Runs fixed-seed scenarios (number of objects x number of worker processes)
+through generate_dataset.py and create_dataset.py on synthetic stand-in
+models (see synthetic_models.py) and reports the scenes per second and the
+per-stage time and memory from the metrics of the workers.
+
+    python benchmarks/run_benchmarks.py --work_dir /tmp/sq_benchmarks --save_baseline baseline.json
+    python benchmarks/run_benchmarks.py --work_dir /tmp/sq_benchmarks --baseline baseline.json
+
+Baselines are only comparable on the same machine and model set.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import synthetic_models
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+GENERATOR_DIR = os.path.join(REPO_DIR, 'RandomSceneGenerator')
+DATASET_DIR = os.path.join(REPO_DIR, 'DatasetCreation')
+
+sys.path.insert(0, GENERATOR_DIR)
+
+from helper import metrics
+
+RUN_NAME = "benchmark"
+
+
+def _run(command, cwd, log_file):
+    start = time.perf_counter()
+    with open(log_file, "w") as log:
+        subprocess.check_call(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+    return time.perf_counter() - start
+
+
+def _phase_result(wall, metrics_dir, n_scenes):
+    records = metrics.load(metrics_dir)
+    result = dict(wall=wall, n_scenes=n_scenes, scenes_per_second=n_scenes / wall, stages={})
+    summary = metrics.summarize(records)
+    for kind_summary in summary.values():
+        for name, stats in kind_summary["stages"].items():
+            result["stages"][name] = {key: stats[key] for key in ("mean", "p90", "total", "peak_rss_max")
+                                      if key in stats}
+    return result, records
+
+
+def run_scenario(work_dir, model_dir, n_objects, n_workers, n_scenes, seed=0, track_memory=False, tsdf=True):
+    """
+    Generates `n_scenes` scenes of n_objects / 2 to n_objects objects and creates their TSDFs
+
+    The generator rejects scenes with fewer than --min_objects objects, so
+    asking for exactly `n_objects` would reject most of the larger scenes.
+    """
+    name = f"objects{n_objects}-workers{n_workers}"
+    scenario_dir = os.path.abspath(os.path.join(work_dir, name))
+    if os.path.exists(scenario_dir):
+        shutil.rmtree(scenario_dir)
+    os.makedirs(scenario_dir)
+    memory_flag = ["--track_memory"] if track_memory else []
+
+    metrics_dir = os.path.join(scenario_dir, "metrics-generation")
+    wall = _run([sys.executable, "generate_dataset.py", os.path.join(scenario_dir, "scenes"), model_dir,
+                 str(n_scenes), "--min_objects", str(max(1, n_objects // 2)), "--max_objects", str(n_objects + 1),
+                 "--n_processes", str(n_workers), "--seed", str(seed), "--run_name", RUN_NAME,
+                 "--metrics_dir", metrics_dir] + memory_flag,
+                cwd=GENERATOR_DIR, log_file=os.path.join(scenario_dir, "generation.log"))
+    generation, records = _phase_result(wall, metrics_dir, n_scenes)
+    generation["valid_scenes"] = sum(bool(r.get("valid")) for r in records)
+    result = dict(n_objects=n_objects, n_workers=n_workers, generation=generation)
+
+    if tsdf and generation["valid_scenes"] > 0:
+        metrics_dir = os.path.join(scenario_dir, "metrics-tsdf")
+        wall = _run([sys.executable, "create_dataset.py", os.path.join(scenario_dir, "scenes", RUN_NAME),
+                     model_dir, "--n_processes", str(n_workers), "--metrics_dir", metrics_dir] + memory_flag,
+                    cwd=DATASET_DIR, log_file=os.path.join(scenario_dir, "tsdf.log"))
+        result["tsdf"], _ = _phase_result(wall, metrics_dir, generation["valid_scenes"])
+    return name, result
+
+
+def print_results(results, baseline=None):
+    print(f"{'scenario':<22}{'phase':<12}{'scenes/s':>10}{'baseline':>10}{'change':>9}")
+    for name, result in results.items():
+        for phase in ("generation", "tsdf"):
+            if phase not in result:
+                continue
+            value = result[phase]["scenes_per_second"]
+            reference = baseline.get(name, {}).get(phase) if baseline else None
+            if reference:
+                change = f"{value / reference['scenes_per_second'] - 1:+.1%}"
+                print(f"{name:<22}{phase:<12}{value:>10.3f}{reference['scenes_per_second']:>10.3f}{change:>9}")
+            else:
+                print(f"{name:<22}{phase:<12}{value:>10.3f}{'-':>10}{'-':>9}")
+            for stage, stats in sorted(result[phase]["stages"].items()):
+                line = f"  {stage:<32}{stats['mean']:>10.3f}s"
+                reference_stats = reference["stages"].get(stage) if reference else None
+                if reference_stats and reference_stats["mean"] > 0:
+                    line += f"{stats['mean'] / reference_stats['mean'] - 1:>+9.1%}"
+                if "peak_rss_max" in stats:
+                    line += f"  rss {metrics.format_size(stats['peak_rss_max'])}"
+                print(line)
+
+
+def regressions(results, baseline, tolerance):
+    """Scenarios and phases whose throughput dropped by more than `tolerance`"""
+    slower = []
+    for name, result in results.items():
+        for phase in ("generation", "tsdf"):
+            reference = baseline.get(name, {}).get(phase)
+            if phase not in result or not reference:
+                continue
+            ratio = result[phase]["scenes_per_second"] / reference["scenes_per_second"]
+            if ratio < 1 - tolerance:
+                slower.append((name, phase, ratio))
+    return slower
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument('--work_dir', help='folder of the generated models, scenes and metrics',
+                        default='benchmark_runs')
+    parser.add_argument('--model_dir', help='models to use instead of the synthetic ones')
+    parser.add_argument('--n_models', type=int, help='number of synthetic models', default=32)
+    parser.add_argument('--n_scenes', type=int, help='scenes per scenario', default=4)
+    parser.add_argument('--objects', type=int, nargs='+', help='maximum objects per scene of the scenarios',
+                        default=[4, 8, 16])
+    parser.add_argument('--workers', type=int, nargs='+', help='worker processes of the scenarios',
+                        default=[1, 2, 4])
+    parser.add_argument('--seed', type=int, help='base seed of the scenes', default=0)
+    parser.add_argument('--track_memory', action='store_true', help='record per-stage peak memory')
+    parser.add_argument('--no_tsdf', action='store_true', help='only benchmark the scene generation')
+    parser.add_argument('--out', help='write the results as json')
+    parser.add_argument('--baseline', help='compare against the results in this json file')
+    parser.add_argument('--save_baseline', help='write the results to this json file as the new baseline')
+    parser.add_argument('--tolerance', type=float, help='allowed relative throughput drop', default=0.1)
+
+    args = parser.parse_args()
+
+    model_dir = args.model_dir
+    if model_dir is None:
+        model_dir = os.path.abspath(os.path.join(args.work_dir, "models"))
+        if not synthetic_models.has_models(model_dir, args.n_models):
+            print(f"building {args.n_models} synthetic models in {model_dir}")
+            synthetic_models.build_models(model_dir, n_models=args.n_models, seed=args.seed)
+    model_dir = os.path.abspath(model_dir)
+
+    results = {}
+    for n_objects in args.objects:
+        for n_workers in args.workers:
+            name, result = run_scenario(args.work_dir, model_dir, n_objects, n_workers, args.n_scenes,
+                                        seed=args.seed, track_memory=args.track_memory, tsdf=not args.no_tsdf)
+            results[name] = result
+            print(f"finished {name}")
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+    print_results(results, baseline)
+
+    for filename in (args.out, args.save_baseline):
+        if filename is not None:
+            with open(filename, "w") as fp:
+                json.dump(results, fp, indent=2)
+
+    if baseline is not None:
+        slower = regressions(results, baseline, args.tolerance)
+        for name, phase, ratio in slower:
+            print(f"regression: {name} {phase} at {ratio:.1%} of the baseline throughput")
+        sys.exit(1 if slower else 0)
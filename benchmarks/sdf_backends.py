@@ -0,0 +1,109 @@
+"""
+Speed and agreement of the SDF methods of create_dataset.py (--sdf_method) on
+generated scenes
+
+Every method computes the scene grid and the per-object grids of the scenes
+like create_dataset.py does. The grids of every method are compared to the
+ones of the reference method (scan by default): intersection over union of the
+inside voxels and the mean and maximum absolute difference, near the surface
+(|sdf| < --near) and everywhere.
+
+    python benchmarks/sdf_backends.py /tmp/sq_benchmarks/objects4-workers1/scenes/benchmark /tmp/sq_benchmarks/models
+
+Methods that fail (e.g. scan without OpenGL) are reported and skipped.
+"""
+import argparse
+import os
+import sys
+import time
+import traceback
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO_DIR, 'RandomSceneGenerator'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'DatasetCreation'))
+
+from data_loader import PileLoader
+from scene_utils.SDFAtlas import SDFAtlas
+from scene_utils.SuperQuadricSDF import SuperQuadricSDF
+from scene_utils.TSDFScene import create_tsdfs_per_object
+
+METHODS = ("scan", "cpu", "analytic", "atlas")
+# agreement columns and their widths
+COLUMNS = dict(iou=8, near_mean=11, near_max=10, mean=9, max=9)
+
+
+def scene_grids(data_loader, scene_dir, method, sdf_atlas=None):
+    """Scene grid and per-object grids of a scene, as create_dataset.py computes them"""
+    scene_info = data_loader.extract_scene_info(scene_dir)
+    if method == "analytic":
+        return SuperQuadricSDF.generate_tsdfs(data_loader.superquadrics_from_scene_info(scene_info), fixed_floor=15)
+    if method == "atlas":
+        return sdf_atlas.generate_tsdfs(data_loader.superquadrics_from_scene_info(scene_info), fixed_floor=15)
+    scene_dict = data_loader.scenedict_from_scene_info(scene_info, cad_id_as_key=False)
+    return create_tsdfs_per_object(scene_dict, fixed_floor=15, method=method)
+
+
+def agreement(grid, reference, near):
+    inside, reference_inside = grid < 0, reference < 0
+    difference = np.abs(grid - reference)
+    close = np.abs(reference) < near
+    return dict(iou=(inside & reference_inside).sum() / max((inside | reference_inside).sum(), 1),
+                near_mean=difference[close].mean() if close.any() else np.nan,
+                near_max=difference[close].max() if close.any() else np.nan,
+                mean=difference.mean(), max=difference.max())
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument('scene_dir', help='folder of generated scenes')
+    parser.add_argument('model_dir', help='path to SQ models')
+    parser.add_argument('--methods', nargs='+', choices=METHODS, help='methods to run', default=["scan", "cpu"])
+    parser.add_argument('--reference', choices=METHODS, help='method the others are compared to', default='scan')
+    parser.add_argument('--atlas_dir', help='sdf atlas of the atlas method (default: <model_dir>/sdf_atlas)')
+    parser.add_argument('--n_scenes', type=int, help='number of scenes to use', default=4)
+    parser.add_argument('--near', type=float, help='distance (world units) of the near surface comparison',
+                        default=0.05)
+
+    args = parser.parse_args()
+
+    data_loader = PileLoader(path_to_scenes=args.scene_dir, path_to_models=args.model_dir)
+    scene_dirs = [data_loader.data[i]['scene_file'] for i in range(min(args.n_scenes, len(data_loader)))]
+    sdf_atlas = SDFAtlas(args.atlas_dir or os.path.join(args.model_dir, 'sdf_atlas'))
+    methods = [args.reference] + [method for method in args.methods if method != args.reference]
+
+    times = {method: [] for method in methods}
+    grids = {method: {} for method in methods}
+    for scene_dir in scene_dirs:
+        for method in methods:
+            start = time.perf_counter()
+            try:
+                scene_grid, object_grids = scene_grids(data_loader, scene_dir, method, sdf_atlas)
+            except Exception:
+                print(f"{method} failed on {scene_dir}")
+                traceback.print_exc()
+                continue
+            times[method].append(time.perf_counter() - start)
+            grids[method][scene_dir] = [scene_grid] + list(object_grids)
+
+    print(f"{len(scene_dirs)} scenes, compared to {args.reference}")
+    print(f"{'method':<10}{'s/scene':>9}" + "".join(f"{key.replace('_', ' '):>{width}}"
+                                                  for key, width in COLUMNS.items()))
+    for method in methods:
+        if not times[method]:
+            print(f"{method:<10}{'failed':>9}")
+            continue
+        line = f"{method:<10}{np.mean(times[method]):>9.3f}"
+        results = [agreement(grid, reference, args.near)
+                   for scene_dir, reference_grids in grids[args.reference].items()
+                   if scene_dir in grids[method]
+                   for grid, reference in zip(grids[method][scene_dir], reference_grids)]
+        if method != args.reference and results:
+            for key, width in COLUMNS.items():
+                line += f"{np.nanmean([result[key] for result in results]):>{width}.4f}"
+        print(line)
@@ -0,0 +1,92 @@
+"""
+Builds a small set of superquadric models in the layout of the downloadable
+model library, as a stand-in for benchmarks:
+
+    <out_dir>/meshes/<cad_id>.obj          superquadric surface mesh
+    <out_dir>/meshes/<cad_id>.convex.obj   its convex hull, used for collisions
+    <out_dir>/parameters/<cad_id>.json     {"scales": "[a1, a2, a3]", "exponents": "[e1, e2]"}
+
+The models are generated from a seed, so every machine benchmarks the same set.
+
+    python benchmarks/synthetic_models.py /tmp/sq_models --n_models 32
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+
+def _signed_power(x, exponent):
+    return np.sign(x) * np.abs(x) ** exponent
+
+
+def superquadric_mesh(scales, exponents, subdivisions=3):
+    """
+    Surface of the superquadric with semi-axes `scales` and shape exponents
+    (e1, e2) as (vertices, faces), obtained by moving the vertices of an
+    icosphere along the latitude / longitude parametrisation
+    """
+    import trimesh
+
+    sphere = trimesh.creation.icosphere(subdivisions=subdivisions)
+    x, y, z = sphere.vertices.T
+    eta = np.arcsin(np.clip(z, -1, 1))
+    omega = np.arctan2(y, x)
+    e1, e2 = exponents
+    vertices = np.stack([
+        scales[0] * _signed_power(np.cos(eta), e1) * _signed_power(np.cos(omega), e2),
+        scales[1] * _signed_power(np.cos(eta), e1) * _signed_power(np.sin(omega), e2),
+        scales[2] * _signed_power(np.sin(eta), e1),
+    ], axis=1)
+    return vertices, sphere.faces
+
+
+def build_models(out_dir, n_models=32, seed=0, scale_range=(0.5, 1.0), exponent_range=(0.3, 1.2),
+                 subdivisions=3):
+    """Writes `n_models` models with cad ids 00000000, 00000001, ... into `out_dir`"""
+    import trimesh
+
+    random_state = np.random.RandomState(seed)
+    mesh_dir = os.path.join(out_dir, "meshes")
+    parameter_dir = os.path.join(out_dir, "parameters")
+    os.makedirs(mesh_dir, exist_ok=True)
+    os.makedirs(parameter_dir, exist_ok=True)
+
+    for index in range(n_models):
+        cad_id = f"{index:08d}"
+        scales = random_state.uniform(*scale_range, size=3)
+        exponents = random_state.uniform(*exponent_range, size=2)
+
+        vertices, faces = superquadric_mesh(scales, exponents, subdivisions=subdivisions)
+        mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+        mesh.export(os.path.join(mesh_dir, f"{cad_id}.obj"))
+        mesh.convex_hull.export(os.path.join(mesh_dir, f"{cad_id}.convex.obj"))
+
+        # the library stores the parameters as json encoded strings
+        with open(os.path.join(parameter_dir, f"{cad_id}.json"), "w") as fp:
+            json.dump(dict(scales=json.dumps(scales.tolist()), exponents=json.dumps(exponents.tolist())), fp)
+
+
+def has_models(model_dir, n_models):
+    return all(
+        os.path.exists(os.path.join(model_dir, "meshes", f"{index:08d}.convex.obj"))
+        and os.path.exists(os.path.join(model_dir, "parameters", f"{index:08d}.json"))
+        for index in range(n_models)
+    )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument('out_dir', help='destination of the models')
+    parser.add_argument('--n_models', type=int, help='number of models', default=32)
+    parser.add_argument('--seed', type=int, help='seed of the model parameters', default=0)
+    parser.add_argument('--subdivisions', type=int, help='icosphere subdivisions of the meshes', default=3)
+
+    args = parser.parse_args()
+
+    build_models(args.out_dir, n_models=args.n_models, seed=args.seed, subdivisions=args.subdivisions)
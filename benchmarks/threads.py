@@ -0,0 +1,90 @@
+"""
+Finds the best split of the cpus into processes x threads per process
+
+Every split runs `n_processes` worker processes with their thread pools limited
+to `threads_per_worker` on a synthetic workload resembling the TSDF creation
+(dense linear algebra and nearest neighbour queries on a 64^3 grid) and
+reports the throughput in tasks per second.
+
+    python benchmarks/threads.py --n_tasks 32
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RandomSceneGenerator'))
+
+from helper import threads
+
+
+def workload(n_tasks, size):
+    import numpy as np
+    from scipy.spatial import cKDTree
+
+    random_state = np.random.RandomState(0)
+    lin = np.linspace(-1, 1, 64)
+    grid = np.stack(np.meshgrid(lin, lin, lin, indexing="ij"), axis=-1).reshape(-1, 3)
+    for _ in range(n_tasks):
+        a = random_state.rand(size, size)
+        np.linalg.solve(a @ a.T + np.eye(size), a)
+        surface = random_state.rand(20000, 3) * 2 - 1
+        cKDTree(surface).query(grid)
+
+
+def splits(n_cpus):
+    for n_processes in range(1, n_cpus + 1):
+        if n_cpus % n_processes == 0:
+            yield n_processes, n_cpus // n_processes
+
+
+def run_split(n_processes, threads_per_worker, n_tasks, size, pin):
+    """Runs `n_tasks` tasks spread over the workers, returns the wall time"""
+    env = dict(os.environ)
+    for name in threads.THREAD_ENV_VARS:
+        env[name] = str(threads_per_worker)
+    tasks_per_worker = [n_tasks // n_processes + (i < n_tasks % n_processes) for i in range(n_processes)]
+    start = time.perf_counter()
+    workers = []
+    for slot, worker_tasks in enumerate(tasks_per_worker):
+        command = [sys.executable, os.path.abspath(__file__), "--worker", str(worker_tasks),
+                   "--size", str(size)]
+        workers.append(subprocess.Popen(command, env=env,
+                                        preexec_fn=lambda slot=slot: threads.pin_worker(
+                                            slot, n_processes, pin, threads_per_worker)))
+    for worker in workers:
+        if worker.wait() != 0:
+            raise RuntimeError(f"worker failed with exit code {worker.returncode}")
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument('--n_tasks', type=int, help='number of tasks per split', default=32)
+    parser.add_argument('--size', type=int, help='matrix size of a task', default=512)
+    parser.add_argument('--n_cpus', type=int, help='cpus to split (default: all available)')
+    parser.add_argument('--pin', choices=threads.PIN_MODES, default='none', help='pin the workers')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        workload(args.worker, args.size)
+        sys.exit(0)
+
+    n_cpus = args.n_cpus or len(threads.available_cpus())
+    results = []
+    print(f"{'processes':>10}{'threads':>10}{'time':>10}{'tasks/s':>10}")
+    for n_processes, threads_per_worker in splits(n_cpus):
+        elapsed = run_split(n_processes, threads_per_worker, args.n_tasks, args.size, args.pin)
+        results.append((args.n_tasks / elapsed, n_processes, threads_per_worker))
+        print(f"{n_processes:>10}{threads_per_worker:>10}{elapsed:>10.2f}{args.n_tasks / elapsed:>10.2f}")
+
+    throughput, n_processes, threads_per_worker = max(results)
+    print(f"best: --n_processes {n_processes} --threads_per_worker {threads_per_worker} "
+          f"({throughput:.2f} tasks/s)")
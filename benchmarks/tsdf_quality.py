@@ -0,0 +1,111 @@
+"""
+Accuracy versus cost of the TSDF quality presets (create_dataset.py --quality)
+
+Every preset computes the scene grids of the scenes in a process of its own,
+which reports the wall time and its peak memory. The grids are compared to
+the ones of the reference preset: intersection over union of the inside
+voxels and the error of the signed distance near the surface (|sdf| below
+--surface voxels of the reference). The grids are compared before the floor
+shift, so that they share the frame.
+
+    python benchmarks/tsdf_quality.py /tmp/sq_benchmarks/objects4-workers1/scenes/benchmark /tmp/sq_benchmarks/models
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO_DIR, 'RandomSceneGenerator'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'DatasetCreation'))
+
+from helper import memory
+from data_loader import PileLoader
+from scene_utils.TSDFScene import TSDFScene, QUALITY_PRESETS
+
+
+def _compute_grids(data_loader, scene_dirs, method, quality, out_dir, result):
+    start = time.perf_counter()
+    for n, scene_dir in enumerate(scene_dirs):
+        scene_info = data_loader.extract_scene_info(scene_dir)
+        scene_dict = data_loader.scenedict_from_scene_info(scene_info, cad_id_as_key=False)
+        grid = TSDFScene.generate_sdf_with_library(scene_dict['scene'], method=method, quality=quality)
+        np.save(os.path.join(out_dir, f"{quality}_{n}.npy"), grid)
+    result['wall'] = time.perf_counter() - start
+    result['peak_rss'] = memory.peak_rss_bytes() or 0
+
+
+def run_preset(data_loader, scene_dirs, method, quality, out_dir):
+    """Wall time and peak rss of a preset on the scenes, run in a fresh process"""
+    with multiprocessing.Manager() as manager:
+        result = manager.dict()
+        process = multiprocessing.Process(target=_compute_grids,
+                                          args=(data_loader, scene_dirs, method, quality, out_dir, result))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"preset {quality} failed")
+        return dict(result)
+
+
+def agreement(grid, reference, surface):
+    inside, reference_inside = grid < 0, reference < 0
+    near = np.abs(reference) < surface
+    error = np.abs(grid - reference)[near]
+    return dict(iou=(inside & reference_inside).sum() / max((inside | reference_inside).sum(), 1),
+                surface_mean=error.mean(), surface_p95=np.percentile(error, 95), surface_max=error.max())
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument('scene_dir', help='folder of generated scenes')
+    parser.add_argument('model_dir', help='path to SQ models')
+    parser.add_argument('--method', choices=("scan", "cpu"), help='sdf method of the presets', default='scan')
+    parser.add_argument('--presets', nargs='+', choices=tuple(QUALITY_PRESETS), help='presets to compare',
+                        default=[quality for quality in QUALITY_PRESETS if quality != 'reference'])
+    parser.add_argument('--reference', choices=tuple(QUALITY_PRESETS), help='preset the others are compared to',
+                        default='reference')
+    parser.add_argument('--n_scenes', type=int, help='number of scenes to use', default=4)
+    parser.add_argument('--surface', type=float, help='near surface band in voxels of the reference', default=2)
+    parser.add_argument('--out', help='write the results as json')
+
+    args = parser.parse_args()
+
+    data_loader = PileLoader(path_to_scenes=args.scene_dir, path_to_models=args.model_dir)
+    scene_dirs = [data_loader.data[i]['scene_file'] for i in range(min(args.n_scenes, len(data_loader)))]
+    # voxels of 1 / 63 world units, see TSDFScene.generate_sdf_with_library
+    surface = args.surface / 63
+
+    results = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        presets = [args.reference] + [quality for quality in args.presets if quality != args.reference]
+        for quality in presets:
+            results[quality] = run_preset(data_loader, scene_dirs, args.method, quality, out_dir)
+            print(f"finished {quality}")
+
+        for quality in presets:
+            scene_results = [agreement(np.load(os.path.join(out_dir, f"{quality}_{n}.npy")),
+                                       np.load(os.path.join(out_dir, f"{args.reference}_{n}.npy")), surface)
+                             for n in range(len(scene_dirs))]
+            for key in scene_results[0]:
+                results[quality][key] = float(np.mean([result[key] for result in scene_results]))
+
+    print(f"{len(scene_dirs)} scenes, method {args.method}, compared to {args.reference}")
+    print(f"{'preset':<12}{'s/scene':>9}{'peak rss':>10}{'iou':>8}{'sdf mean':>10}{'sdf p95':>10}{'sdf max':>10}")
+    for quality, result in results.items():
+        print(f"{quality:<12}{result['wall'] / len(scene_dirs):>9.3f}{memory.format_size(result['peak_rss']):>10}"
+              f"{result['iou']:>8.4f}{result['surface_mean']:>10.5f}{result['surface_p95']:>10.5f}"
+              f"{result['surface_max']:>10.5f}")
+
+    if args.out is not None:
+        with open(args.out, "w") as fp:
+            json.dump(results, fp, indent=2)